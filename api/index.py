@@ -1,14 +1,10 @@
-from fastapi import FastAPI
+import os
+import sys
 
-app = FastAPI()
+# Vercel runs this file from api/; the backend package lives one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-@app.get("/api/ping")
-async def ping():
-    return {"ok": True}
-
-@app.post("/api/chat")
-async def chat():
-    return {"response": "Service is initializing. Please try again shortly."}
+from backend.main import app  # noqa: E402
 
 # Ensure Vercel can find the handler
-handler = app
\ No newline at end of file
+handler = app
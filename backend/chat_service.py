@@ -1,144 +1,451 @@
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None
 import os
 import json
 import uuid
-import time
+import asyncio
 from datetime import datetime
-from typing import List, Dict, Optional
-from dotenv import load_dotenv
+from typing import AsyncIterator, Callable, List, Dict, Optional
 
-load_dotenv()
+from backend.conversation_context import ConversationContext, estimate_tokens
+from backend.conversation_store import Conversation
+from backend.model_client import ModelCallError, get_gemini_model, get_model_client
+from backend.retrieval import RetrievalIndexCache, chunk_text, format_excerpts, tokenize
+from backend.similarity_cache import create_similarity_cache
+from backend.storage import create_conversation_store
+
+
+SYSTEM_PROMPT = "You are a helpful AI assistant similar to ChatGPT. You are knowledgeable, friendly, and provide detailed responses.\n\n"
 
 class ChatService:
     def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        self.model = None
-        if genai and api_key:
-            try:
-                genai.configure(api_key=api_key)
-                self.model = genai.GenerativeModel('gemini-2.5-flash')
-            except Exception:
-                # If model initialization fails, keep graceful fallback
-                self.model = None
+        self.model = get_gemini_model()
+        self.client = get_model_client()
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 8000))
+        self.context_summary_budget = int(os.getenv("CONTEXT_SUMMARY_BUDGET", 1000))
+        # In memory (idle and least recently used conversations are evicted) or in SQLite, shared by all workers;
+        # the SQLite cache keeps only the recent messages _get_context() seeds a prompt context from
+        self.conversations = create_conversation_store(
+            max_conversations=int(os.getenv("CONVERSATION_MAX_COUNT", 1000)),
+            idle_ttl=float(os.getenv("CONVERSATION_IDLE_TTL", 86400)),
+            max_bytes=int(os.getenv("CONVERSATION_MAX_BYTES", 100 * 1024 * 1024)),
+            window_tokens=self.context_token_budget // 2
+        )
+        self.analysis_cache_ttl = 3600  # seconds; file analysis prompts are deterministic
+        self.retrieval_indexes = RetrievalIndexCache(max_indexes=int(os.getenv("RETRIEVAL_INDEX_CACHE", 32)))
+        self.retrieval_min_chars = int(os.getenv("RETRIEVAL_MIN_CHARS", 8000))
+        self.retrieval_top_k = int(os.getenv("RETRIEVAL_TOP_K", 5))
+        # Files whose content exceeds one prompt's budget are analyzed map-reduce style
+        self.analysis_token_budget = int(os.getenv("FILE_ANALYSIS_TOKEN_BUDGET", 100000))
+        self.analysis_chunk_tokens = int(os.getenv("FILE_ANALYSIS_CHUNK_TOKENS", 20000))
+        self.analysis_concurrency = int(os.getenv("FILE_ANALYSIS_CONCURRENCY", 4))
+        self.max_reduce_rounds = 4  # Reduce prompts rejected as too large before giving up
+        # Opt-in cache of first-turn answers shared by near-duplicate prompts (see SIMILARITY_CACHE)
+        self.similarity_cache = create_similarity_cache("chat")
         
-        self.conversations = {}  # In-memory storage for demo
-        self.max_retries = 3
-        self.retry_delay = 1  # seconds
-        
-    async def get_response(self, message: str, conversation_id: Optional[str] = None) -> str:
-        """Get response from Gemini API with error handling and retries"""
+    async def get_response(self, message: str, conversation_id: Optional[str] = None, use_cache: bool = True,
+                           attachments: Optional[List[Dict]] = None, raise_errors: bool = False) -> str:
+        """Get response from Gemini API with error handling and retries.
+
+        attachments are image parts ({"mime_type", "data"}) sent along with
+        this message; the history keeps only the message text. With
+        raise_errors, a failed call raises ModelCallError instead of
+        returning a friendly error message.
+        """
         if not self.model:
+            if raise_errors:
+                raise ModelCallError("auth", RuntimeError("AI service is not configured. Please set GEMINI_API_KEY."))
             return "AI service is not configured. Please set GEMINI_API_KEY."
-        for attempt in range(self.max_retries):
-            try:
-                # Get or create conversation
-                if conversation_id and conversation_id in self.conversations:
-                    conversation_history = self.conversations[conversation_id]
-                else:
-                    conversation_id = conversation_id or str(uuid.uuid4())
-                    conversation_history = []
-                    self.conversations[conversation_id] = conversation_history
-                
-                # Build conversation context for Gemini
-                context = "You are a helpful AI assistant similar to ChatGPT. You are knowledgeable, friendly, and provide detailed responses.\n\n"
-                
-                # Add conversation history
-                for msg in conversation_history:
-                    if msg["role"] == "user":
-                        context += f"User: {msg['content']}\n"
-                    elif msg["role"] == "assistant":
-                        context += f"Assistant: {msg['content']}\n"
-                
-                # Add current user message
-                context += f"User: {message}\nAssistant:"
-                
-                # Get response from Gemini
-                response = self.model.generate_content(context)
-                
-                # Check if response is valid
-                if not response or not response.text:
-                    raise ValueError("Empty response from Gemini API")
-                
-                assistant_message = response.text
-                
-                # Add messages to conversation history
-                conversation_history.append({"role": "user", "content": message})
-                conversation_history.append({"role": "assistant", "content": assistant_message})
-                
-                # Update conversation
-                self.conversations[conversation_id] = conversation_history
-                
-                return assistant_message
-                
-            except Exception as e:
-                error_msg = str(e).lower()
-                
-                # Check for specific error types
-                if "quota" in error_msg or "rate limit" in error_msg:
-                    if attempt < self.max_retries - 1:
-                        wait_time = self.retry_delay * (2 ** attempt)  # Exponential backoff
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        return "I'm currently experiencing high demand. Please try again in a few moments."
-                
-                elif "api key" in error_msg or "authentication" in error_msg:
-                    return "There's an issue with the API configuration. Please contact support."
-                
-                elif "network" in error_msg or "connection" in error_msg:
-                    if attempt < self.max_retries - 1:
-                        time.sleep(self.retry_delay)
-                        continue
-                    else:
-                        return "I'm having trouble connecting to the service. Please check your internet connection and try again."
-                
-                elif attempt < self.max_retries - 1:
-                    # Generic retry for other errors
-                    time.sleep(self.retry_delay)
-                    continue
-                else:
-                    # Final fallback
-                    return f"I apologize, but I encountered an error: {str(e)}. Please try rephrasing your question or try again later."
-        
-        return "I'm currently unable to process your request. Please try again later."
+
+        conversation_id, conversation = await self._get_or_create_conversation(conversation_id)
+        cacheable = not attachments and self._first_turn_cacheable(conversation)
+        if cacheable and use_cache:
+            cached = self.similarity_cache.get(message)
+            if cached is not None:
+                self._append_turn(conversation_id, conversation, message, cached)
+                await self.conversations.flush()
+                return cached
+        context = await self._build_context(conversation, message)
+
+        try:
+            # Get response from Gemini
+            prompt = [context, *attachments] if attachments else context
+            assistant_message = await self.client.generate(self.model, prompt, call_site="chat_image" if attachments else "chat")
+        except ModelCallError as e:
+            if raise_errors:
+                raise
+            return self.chat_error_message(e)
+
+        if cacheable:
+            self.similarity_cache.set(message, assistant_message)
+        self._append_turn(conversation_id, conversation, message, assistant_message)
+        await self.conversations.flush()
+        return assistant_message
+
+    async def stream_response(self, message: str, conversation_id: Optional[str] = None, use_cache: bool = True) -> AsyncIterator[str]:
+        """Stream the response token by token; history is updated once the stream completes"""
+        if not self.model:
+            yield "AI service is not configured. Please set GEMINI_API_KEY."
+            return
+
+        conversation_id, conversation = await self._get_or_create_conversation(conversation_id)
+        cacheable = self._first_turn_cacheable(conversation)
+        if cacheable and use_cache:
+            cached = self.similarity_cache.get(message)
+            if cached is not None:
+                yield cached
+                self._append_turn(conversation_id, conversation, message, cached)
+                await self.conversations.flush()
+                return
+        context = await self._build_context(conversation, message)
+
+        chunks = []
+        try:
+            async for chunk in self.client.stream(self.model, context, call_site="chat_stream"):
+                chunks.append(chunk)
+                yield chunk
+        except ModelCallError as e:
+            prefix = "\n\n" if chunks else ""
+            yield prefix + self.chat_error_message(e)
+            return
+
+        assistant_message = "".join(chunks)
+        if cacheable:
+            self.similarity_cache.set(message, assistant_message)
+        self._append_turn(conversation_id, conversation, message, assistant_message)
+        await self.conversations.flush()
+
+    def _first_turn_cacheable(self, conversation: Conversation) -> bool:
+        """Whether the reply depends on the message alone: a new conversation, with the similarity cache enabled"""
+        return self.similarity_cache is not None and conversation.message_count == 0
+
+    async def _get_or_create_conversation(self, conversation_id: Optional[str]):
+        """Return the conversation ID and its record, creating it if needed"""
+        conversation_id = conversation_id or str(uuid.uuid4())
+        return conversation_id, await self.conversations.get_or_create(conversation_id)
+
+    async def _build_context(self, conversation: Conversation, message: str) -> str:
+        """Build conversation context for Gemini, folding old turns once over budget"""
+        context = self._get_context(conversation)
+        if context.needs_fold(message):
+            async with context.lock:
+                if context.needs_fold(message):
+                    folded = context.pop_oldest(message)
+                    if folded:
+                        context.set_summary(await self._summarize_turns(context.summary, folded))
+        return context.render(message)
+
+    def _get_context(self, conversation: Conversation) -> ConversationContext:
+        """Get or create the prompt context for a conversation"""
+        if conversation.context is None:
+            context = ConversationContext(SYSTEM_PROMPT, self.context_token_budget, self.context_summary_budget)
+            # History written by another worker or before a restart: start from the turns that fit half the budget
+            recent, tokens = [], 0
+            for msg in reversed(conversation.messages):
+                tokens += estimate_tokens(msg.content)
+                if tokens > self.context_token_budget // 2:
+                    break
+                recent.append(msg)
+            for msg in reversed(recent):
+                context.append(msg.role, msg.content)
+            conversation.context = context
+        return conversation.context
+
+    async def _summarize_turns(self, summary: str, turns: List[str]) -> str:
+        """Fold turns into the rolling summary, falling back to a condensed transcript"""
+        # Cap each turn so a pasted document cannot blow up the summarization prompt
+        max_chars = self.context_summary_budget * 4
+        transcript = "".join(turn if len(turn) <= max_chars else turn[:max_chars] + "...\n" for turn in turns)
+        prompt = f"""Update the running summary of a conversation between a user and an AI assistant with the new exchanges below. Keep names, facts, decisions and open questions. Stay under {self.context_summary_budget // 2} words.
+
+Current summary:
+{summary or "(none)"}
+
+New exchanges:
+{transcript}
+Updated summary:"""
+
+        try:
+            return await self.client.generate(self.model, prompt, call_site="context_summary")
+        except ModelCallError:
+            condensed = "".join(turn if len(turn) <= 200 else turn[:200] + "...\n" for turn in turns)
+            return f"{summary}\n{condensed}" if summary else condensed
+
+    def _append_turn(self, conversation_id: str, conversation: Conversation, message: str, assistant_message: str):
+        """Add a completed user/assistant exchange to the conversation history"""
+        # Context first, so the store counts its new size along with the messages
+        context = self._get_context(conversation)
+        context.append("user", message)
+        context.append("assistant", assistant_message)
+
+        self.conversations.add_message(conversation_id, "user", message)
+        self.conversations.add_message(conversation_id, "assistant", assistant_message)
+
+    def chat_error_message(self, error: ModelCallError) -> str:
+        """Friendly message for a failed chat call"""
+        if error.kind == "quota":
+            return "I'm currently experiencing high demand. Please try again in a few moments."
+        elif error.kind == "auth":
+            return "There's an issue with the API configuration. Please contact support."
+        elif error.kind == "network":
+            return "I'm having trouble connecting to the service. Please check your internet connection and try again."
+        elif error.kind == "timeout":
+            return "The service is taking too long to respond. Please try again in a few moments."
+        elif error.kind in ("unavailable", "server"):
+            return "The service is temporarily unavailable. Please try again in a minute."
+        elif error.kind == "blocked":
+            return "I couldn't generate a response to that message. Please try rephrasing it."
+        # Final fallback
+        return f"I apologize, but I encountered an error: {str(error)}. Please try rephrasing your question or try again later."
     
     async def get_conversation_history(self, conversation_id: str) -> List[Dict]:
         """Get conversation history"""
-        if conversation_id in self.conversations:
-            return self.conversations[conversation_id]
-        return []
+        count = await self.conversations.count_messages(conversation_id)
+        return [msg.to_dict() for msg in await self.conversations.messages(conversation_id, 0, count)]
+
+    async def get_history_page(self, conversation_id: str, limit: int = 50, before: Optional[int] = None,
+                               after: Optional[int] = None) -> Dict:
+        """A page of messages in chronological order: the latest limit, or those just before or after a cursor.
+
+        Cursors are message indexes. prev_cursor (pass as before) is set when
+        older messages exist, next_cursor (pass as after) when newer ones do.
+        """
+        total = await self.conversations.count_messages(conversation_id)
+        if after is not None:
+            start = min(after + 1, total)
+            stop = min(start + limit, total)
+        else:
+            stop = total if before is None else max(0, min(before, total))
+            start = max(0, stop - limit)
+        messages = await self.conversations.messages(conversation_id, start, stop) if start < stop else []
+        return {
+            "messages": [{"index": start + offset, **msg.to_dict()} for offset, msg in enumerate(messages)],
+            "message_count": total,
+            "prev_cursor": start if start > 0 else None,
+            "next_cursor": stop - 1 if 0 < stop < total else None
+        }
+
+    async def iter_history(self, conversation_id: str, batch_size: int = 500) -> AsyncIterator[Dict]:
+        """Every message of a conversation, read from the store a batch at a time"""
+        total = await self.conversations.count_messages(conversation_id)
+        for start in range(0, total, batch_size):
+            for offset, msg in enumerate(await self.conversations.messages(conversation_id, start, min(start + batch_size, total))):
+                yield {"index": start + offset, **msg.to_dict()}
+            # Let other requests run between batches of a large export
+            await asyncio.sleep(0)
     
     async def get_all_conversations(self) -> Dict:
         """Get all conversations with metadata"""
-        result = {}
-        for conv_id, messages in self.conversations.items():
-            if messages:
-                first_message = next((msg for msg in messages if msg["role"] == "user"), None)
-                title = first_message["content"][:50] + "..." if first_message and len(first_message["content"]) > 50 else first_message["content"] if first_message else "New Conversation"
-                result[conv_id] = {
-                    "title": title,
-                    "message_count": len(messages),
-                    "last_updated": datetime.now().isoformat()
-                }
-        return result
-    
+        conversations, _ = self.conversations.recent(len(self.conversations))
+        return {conv_id: self._conversation_summary(conv_id, conversation) for conv_id, conversation in conversations}
+
+    async def list_conversations(self, limit: int = 20, cursor: Optional[int] = None) -> Dict:
+        """A page of conversation metadata, most recently updated first"""
+        conversations, next_cursor = self.conversations.recent(limit, cursor)
+        return {
+            "conversations": [self._conversation_summary(conv_id, conversation) for conv_id, conversation in conversations],
+            "next_cursor": next_cursor
+        }
+
+    async def search_conversations(self, query: str, limit: int = 20, cursor: Optional[int] = None) -> Dict:
+        """Conversations whose messages contain every keyword of the query"""
+        conversations, next_cursor = self.conversations.search(query, limit, cursor)
+        terms = set(tokenize(query))
+        results = []
+        for conv_id, conversation in conversations:
+            summary = self._conversation_summary(conv_id, conversation)
+            summary["snippet"] = self.conversations.snippet(conv_id, terms)
+            results.append(summary)
+        return {"conversations": results, "next_cursor": next_cursor}
+
+    def _conversation_summary(self, conversation_id: str, conversation: Conversation) -> Dict:
+        return {
+            "conversation_id": conversation_id,
+            "title": conversation.title or "New Conversation",
+            "message_count": conversation.message_count,
+            "created_at": datetime.fromtimestamp(conversation.created_at).isoformat(),
+            "last_updated": datetime.fromtimestamp(conversation.updated_at).isoformat()
+        }
+
     async def clear_conversation(self, conversation_id: str):
         """Clear conversation history"""
-        if conversation_id in self.conversations:
-            del self.conversations[conversation_id]
+        self.conversations.delete(conversation_id)
+        await self.conversations.flush()
     
-    async def analyze_file_content(self, content: str, filename: str, user_question: str = None) -> str:
-        """Analyze file content using Gemini with error handling and retries"""
+    async def analyze_file_content(self, content: str, filename: str, user_question: str = None, use_cache: bool = True,
+                                   map_reduce: Optional[bool] = None, progress: Optional[Callable[[Dict], None]] = None) -> str:
+        """Analyze file content using Gemini with error handling and retries.
+
+        Content too large for one prompt is analyzed map-reduce style (see
+        iter_file_analysis); progress, if given, is called with each
+        progress and partial-result event.
+        """
         if not self.model:
             return "AI service is not configured for file analysis. Please set GEMINI_API_KEY."
-        for attempt in range(self.max_retries):
+        try:
+            async for event in self.iter_file_analysis(content, filename, user_question, use_cache, map_reduce):
+                if event["type"] == "result":
+                    return event["text"]
+                if progress:
+                    progress(event)
+        except ModelCallError as e:
+            return self.file_analysis_error(e, filename)
+        return self.file_analysis_error(ModelCallError("other", RuntimeError("No analysis was produced")), filename)
+
+    async def iter_file_analysis(self, content: str, filename: str, user_question: str = None, use_cache: bool = True,
+                                 map_reduce: Optional[bool] = None) -> AsyncIterator[Dict]:
+        """Analyze file content, yielding events as the work progresses.
+
+        Events are dicts with a "type": "progress" (stage, done, total),
+        "partial" (index and text of one chunk's notes, in completion order)
+        and finally "result" (text, chunks). With map_reduce=None, content over
+        FILE_ANALYSIS_TOKEN_BUDGET or rejected by the model as too large is
+        split into token-budgeted chunks that are analyzed concurrently and
+        then combined; True forces this, False never does it. Raises
+        ModelCallError when the analysis fails.
+        """
+        full_content = content
+        # Questions about large files only need the relevant excerpts, unless an exhaustive answer is asked for
+        if user_question and not map_reduce and len(content) > self.retrieval_min_chars:
+            index = await asyncio.to_thread(self.retrieval_indexes.get, content)
+            content = format_excerpts(index.top_chunks(user_question, self.retrieval_top_k))
+
+        use_map_reduce = map_reduce or (map_reduce is None and estimate_tokens(content) > self.analysis_token_budget)
+        if not use_map_reduce:
             try:
-                # Prepare the prompt for file analysis
-                if user_question:
-                    prompt = f"""Please analyze the following file content and answer the user's question.
+                # Get response from Gemini
+                text = await self.client.generate(
+                    self.model, self._file_analysis_prompt(content, filename, user_question),
+                    cache_ttl=self.analysis_cache_ttl, use_cache=use_cache, call_site="file_analysis"
+                )
+            except ModelCallError as e:
+                if e.kind != "too_large" or map_reduce is False:
+                    raise
+                use_map_reduce = True
+            else:
+                yield {"type": "result", "text": text, "chunks": 1}
+
+        if use_map_reduce:
+            async for event in self._map_reduce_analysis(full_content, filename, user_question, use_cache):
+                yield event
+
+    async def _map_reduce_analysis(self, content: str, filename: str, user_question: Optional[str], use_cache: bool) -> AsyncIterator[Dict]:
+        chunks = await asyncio.to_thread(chunk_text, content, self.analysis_chunk_tokens * 4, 200)
+        total = len(chunks)
+        semaphore = asyncio.Semaphore(self.analysis_concurrency)
+
+        async def map_chunk(index: int, chunk: str):
+            async with semaphore:
+                try:
+                    prompt = self._map_prompt(chunk, index, total, filename, user_question)
+                    return index, await self.client.generate(
+                        self.model, prompt, cache_ttl=self.analysis_cache_ttl, use_cache=use_cache, call_site="file_analysis_map"
+                    ), None
+                except ModelCallError as e:
+                    return index, None, e
+
+        yield {"type": "progress", "stage": "map", "done": 0, "total": total}
+        notes: List[Optional[str]] = [None] * total
+        errors: List[ModelCallError] = []
+        tasks = [asyncio.create_task(map_chunk(index, chunk)) for index, chunk in enumerate(chunks)]
+        try:
+            for done, finished in enumerate(asyncio.as_completed(tasks), 1):
+                index, text, error = await finished
+                if error is not None:
+                    errors.append(error)
+                else:
+                    notes[index] = text
+                    yield {"type": "partial", "index": index, "text": text}
+                yield {"type": "progress", "stage": "map", "done": done, "total": total}
+        finally:
+            # Stop outstanding chunks if the consumer went away
+            for task in tasks:
+                task.cancel()
+
+        if len(errors) == total:
+            raise errors[0]
+        sections = [f"[Part {index + 1} of {total}]\n{text}" for index, text in enumerate(notes) if text is not None]
+        if errors:
+            sections.append(f"[{len(errors)} of {total} parts could not be analyzed and are missing from these notes]")
+
+        yield {"type": "progress", "stage": "reduce", "done": 0, "total": 1}
+        text = await self._reduce_notes(sections, filename, user_question, use_cache)
+        yield {"type": "progress", "stage": "reduce", "done": 1, "total": 1}
+        yield {"type": "result", "text": text, "chunks": total, "failed_chunks": len(errors)}
+
+    async def _reduce_notes(self, sections: List[str], filename: str, user_question: Optional[str], use_cache: bool) -> str:
+        """Combine per-chunk notes, condensing them in rounds while they exceed the prompt budget"""
+        semaphore = asyncio.Semaphore(self.analysis_concurrency)
+
+        async def condense(batch: List[str]) -> str:
+            focus = f" relevant to the question: {user_question}" if user_question else ""
+            notes = "\n\n".join(batch)
+            async with semaphore:
+                prompt = f"""The following are notes taken from consecutive parts of the file {filename}.
+Condense them into one set of notes, keeping every fact, figure and point{focus}.
+
+{notes}"""
+                return await self.client.generate(self.model, prompt, cache_ttl=self.analysis_cache_ttl, use_cache=use_cache, call_site="file_analysis_reduce")
+
+        budget = self.analysis_token_budget
+        rejected: Optional[ModelCallError] = None
+        for _ in range(self.max_reduce_rounds):
+            condensed = False
+            while len(sections) > 1 and estimate_tokens("\n\n".join(sections)) > budget:
+                batches: List[List[str]] = [[]]
+                size = 0
+                for section in sections:
+                    tokens = estimate_tokens(section)
+                    if batches[-1] and size + tokens > min(self.analysis_chunk_tokens, budget):
+                        batches.append([])
+                        size = 0
+                    batches[-1].append(section)
+                    size += tokens
+                if len(batches) == len(sections):
+                    # Every note is already a batch of its own; condensing further cannot shrink the count
+                    break
+                sections = list(await asyncio.gather(*(condense(batch) for batch in batches)))
+                condensed = True
+            if rejected is not None and not condensed:
+                # Nothing could be combined under the smaller budget; the same prompt would be rejected again
+                raise rejected
+
+            notes = "\n\n".join(sections)
+            try:
+                return await self.client.generate(
+                    self.model, self._reduce_prompt(notes, filename, user_question),
+                    cache_ttl=self.analysis_cache_ttl, use_cache=use_cache, call_site="file_analysis_reduce"
+                )
+            except ModelCallError as e:
+                if e.kind != "too_large" or len(sections) == 1:
+                    raise
+                # The model's limit is below the configured budget; condense further and retry
+                rejected = e
+                budget = estimate_tokens(notes) // 2
+        raise rejected
+
+    def _reduce_prompt(self, notes: str, filename: str, user_question: Optional[str]) -> str:
+        if user_question:
+            return f"""The following notes were taken from each part of the file {filename}, in order, with the user's question in mind.
+
+User Question: {user_question}
+
+Notes:
+{notes}
+
+Using these notes, provide a detailed answer to the user's question based on the file content."""
+        return f"""The following notes were taken from each part of the file {filename}, in order.
+
+Notes:
+{notes}
+
+Using these notes, please provide:
+1. A summary of the content
+2. Key points or important information
+3. Any insights or observations about the file"""
+
+    def _file_analysis_prompt(self, content: str, filename: str, user_question: Optional[str]) -> str:
+        # Prepare the prompt for file analysis
+        if user_question:
+            return f"""Please analyze the following file content and answer the user's question.
 
 File: {filename}
 User Question: {user_question}
@@ -147,8 +454,7 @@ File Content:
 {content}
 
 Please provide a detailed analysis and answer the user's question based on the file content."""
-                else:
-                    prompt = f"""Please analyze the following file content and provide a comprehensive summary.
+        return f"""Please analyze the following file content and provide a comprehensive summary.
 
 File: {filename}
 
@@ -159,47 +465,54 @@ Please provide:
 1. A summary of the content
 2. Key points or important information
 3. Any insights or observations about the file"""
-                
-                # Get response from Gemini
-                response = self.model.generate_content(prompt)
-                
-                # Check if response is valid
-                if not response or not response.text:
-                    raise ValueError("Empty response from Gemini API")
-                
-                return response.text
-                
-            except Exception as e:
-                error_msg = str(e).lower()
-                
-                # Check for specific error types
-                if "quota" in error_msg or "rate limit" in error_msg:
-                    if attempt < self.max_retries - 1:
-                        wait_time = self.retry_delay * (2 ** attempt)  # Exponential backoff
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        return "I'm currently experiencing high demand analyzing files. Please try again in a few moments."
-                
-                elif "api key" in error_msg or "authentication" in error_msg:
-                    return "There's an issue with the API configuration for file analysis. Please contact support."
-                
-                elif "network" in error_msg or "connection" in error_msg:
-                    if attempt < self.max_retries - 1:
-                        time.sleep(self.retry_delay)
-                        continue
-                    else:
-                        return "I'm having trouble connecting to the service for file analysis. Please check your internet connection and try again."
-                
-                elif "content too large" in error_msg or "token limit" in error_msg:
-                    return f"The file '{filename}' is too large to analyze. Please try with a smaller file or extract specific sections."
-                
-                elif attempt < self.max_retries - 1:
-                    # Generic retry for other errors
-                    time.sleep(self.retry_delay)
-                    continue
-                else:
-                    # Final fallback
-                    return f"I apologize, but I encountered an error analyzing the file '{filename}': {str(e)}. Please try again later or with a different file."
-        
-        return f"I'm currently unable to analyze the file '{filename}'. Please try again later."
\ No newline at end of file
+
+    def _map_prompt(self, chunk: str, index: int, total: int, filename: str, user_question: Optional[str]) -> str:
+        if user_question:
+            task = f"""Extract everything in this part that helps answer the user's question, with specific facts and figures.
+If nothing in this part is relevant, reply with "Nothing relevant."
+
+User Question: {user_question}"""
+        else:
+            task = "Summarize this part: its main points, key facts and figures, and anything notable."
+        return f"""This is part {index + 1} of {total} of the file {filename}.
+{task}
+
+Part {index + 1} Content:
+{chunk}"""
+
+    async def analyze_image(self, image: Dict, filename: str, user_question: str = None, use_cache: bool = True) -> str:
+        """Describe an image, or answer a question about it, with the image sent as model input"""
+        if not self.model:
+            return "AI service is not configured for file analysis. Please set GEMINI_API_KEY."
+        if user_question:
+            prompt = f"Please look at the attached image ({filename}) and answer the user's question.\n\nUser Question: {user_question}"
+        else:
+            prompt = f"""Please analyze the attached image ({filename}) and provide:
+1. A description of what it shows
+2. Any text, figures or data visible in it
+3. Any insights or observations about it"""
+        try:
+            return await self.client.generate(
+                self.model, [prompt, image], cache_ttl=self.analysis_cache_ttl, use_cache=use_cache, call_site="image_analysis"
+            )
+        except ModelCallError as e:
+            return self.file_analysis_error(e, filename)
+
+    def file_analysis_error(self, error: ModelCallError, filename: str) -> str:
+        """Friendly message for a failed file analysis"""
+        if error.kind == "quota":
+            return "I'm currently experiencing high demand analyzing files. Please try again in a few moments."
+        elif error.kind == "auth":
+            return "There's an issue with the API configuration for file analysis. Please contact support."
+        elif error.kind == "network":
+            return "I'm having trouble connecting to the service for file analysis. Please check your internet connection and try again."
+        elif error.kind == "timeout":
+            return f"Analyzing '{filename}' took too long. Please try again in a few moments."
+        elif error.kind in ("unavailable", "server"):
+            return "The file analysis service is temporarily unavailable. Please try again in a minute."
+        elif error.kind == "blocked":
+            return f"I couldn't generate an analysis of '{filename}'. Please try a different question or file."
+        elif error.kind == "too_large":
+            return f"The file '{filename}' is too large to analyze. Please try with a smaller file or extract specific sections."
+        # Final fallback
+        return f"I apologize, but I encountered an error analyzing the file '{filename}': {str(error)}. Please try again later or with a different file."
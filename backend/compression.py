@@ -0,0 +1,83 @@
+import asyncio
+import gzip
+from typing import List, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> List[str]:
+    """Content codings the client accepts (q > 0), lowercased"""
+    encodings = []
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        quality = 1.0
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name and quality > 0:
+            encodings.append(name.lower())
+    return encodings
+
+
+def choose_encoding(accept_encoding: Optional[str], available: Sequence[str]) -> str:
+    """Best of the available codings (in preference order) the client accepts, else identity"""
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in available:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return "identity"
+
+
+class JSONGzipMiddleware:
+    """ASGI middleware gzip-compressing large JSON responses.
+
+    Only complete (non-streamed) application/json bodies of at least
+    minimum_size bytes are compressed, so SSE and NDJSON streams keep being
+    delivered incrementally.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, level: int = 6):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in accepted_encodings(Headers(scope=scope).get("accept-encoding")):
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        chunks: List[bytes] = []
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if headers.get("content-type", "").startswith("application/json") and "content-encoding" not in headers:
+                    start_message = message  # Hold until the whole body is known
+                    return
+            elif message["type"] == "http.response.body" and start_message is not None:
+                chunks.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                await self._send_buffered(send, start_message, b"".join(chunks))
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _send_buffered(self, send, start_message, body: bytes):
+        headers = MutableHeaders(raw=start_message["headers"])
+        if len(body) >= self.minimum_size:
+            if len(body) > 256 * 1024:
+                body = await asyncio.to_thread(gzip.compress, body, self.level)
+            else:
+                body = gzip.compress(body, self.level)
+            headers["content-encoding"] = "gzip"
+            headers["content-length"] = str(len(body))
+        headers.add_vary_header("Accept-Encoding")
+        await send(start_message)
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,98 @@
+import asyncio
+import sys
+from collections import deque
+from typing import Deque, List, Tuple
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (roughly 4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+class ConversationContext:
+    """Prompt context for one conversation, maintained incrementally.
+
+    Recent turns are kept verbatim in a sliding window with a running token
+    estimate and a cached rendered prefix, so each turn only appends to the
+    prompt instead of re-concatenating the whole history. Once the budget is
+    exceeded the oldest turns are folded into a rolling summary.
+    """
+
+    def __init__(self, system_prompt: str, token_budget: int = 8000, summary_budget: int = 1000):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.summary = ""
+        self.turns: Deque[Tuple[str, int]] = deque()  # (rendered line, token estimate)
+        self.lock = asyncio.Lock()
+        self._system_tokens = estimate_tokens(system_prompt)
+        self._summary_tokens = 0
+        self._window_tokens = 0
+        self._turn_bytes = 0
+        self._prefix = None
+
+    @property
+    def token_count(self) -> int:
+        """Estimated tokens of the rendered prefix"""
+        return self._system_tokens + self._summary_tokens + self._window_tokens
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the window, summary and cached prefix (not the shared system prompt)"""
+        prefix = sys.getsizeof(self._prefix) if self._prefix is not None else 0
+        return sys.getsizeof(self) + self._turn_bytes + sys.getsizeof(self.summary) + prefix
+
+    def append(self, role: str, content: str):
+        """Add a message to the sliding window"""
+        label = "User" if role == "user" else "Assistant"
+        line = f"{label}: {content}\n"
+        tokens = estimate_tokens(line)
+        self.turns.append((line, tokens))
+        self._window_tokens += tokens
+        self._turn_bytes += sys.getsizeof(line)
+        if self._prefix is not None:
+            self._prefix += line
+
+    def needs_fold(self, message: str = "") -> bool:
+        """Whether rendering the next prompt would exceed the token budget"""
+        return self.token_count + estimate_tokens(message) > self.token_budget
+
+    def pop_oldest(self, message: str = "") -> List[str]:
+        """Remove the oldest turns until the prompt fits in half the budget.
+
+        Folding well below the budget means the (possibly model-backed)
+        summarization runs once every several turns rather than on each one.
+        """
+        target = self.token_budget // 2 - estimate_tokens(message)
+        folded = []
+        while self.turns and self.token_count > target:
+            line, tokens = self.turns.popleft()
+            self._window_tokens -= tokens
+            self._turn_bytes -= sys.getsizeof(line)
+            folded.append(line)
+        self._prefix = None
+        return folded
+
+    def set_summary(self, summary: str):
+        """Replace the rolling summary, keeping it within its own budget"""
+        max_chars = self.summary_budget * 4
+        summary = summary.strip()
+        if len(summary) > max_chars:
+            # Keep the most recent part of an over-long summary
+            summary = summary[-max_chars:]
+        self.summary = summary
+        self._summary_tokens = estimate_tokens(summary) if summary else 0
+        self._prefix = None
+
+    def render(self, message: str) -> str:
+        """Render the prompt for the next user message"""
+        if self._prefix is None:
+            self._prefix = self._render_prefix()
+        return f"{self._prefix}User: {message}\nAssistant:"
+
+    def _render_prefix(self) -> str:
+        parts = [self.system_prompt]
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation:\n{self.summary}\n\n")
+        parts.extend(line for line, _ in self.turns)
+        return "".join(parts)
@@ -0,0 +1,261 @@
+import sys
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from backend.retrieval import tokenize
+
+TITLE_CHARS = 50
+
+
+class Message:
+    """Compact chat message record"""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.content)
+
+    def to_dict(self) -> Dict:
+        return {"role": self.role, "content": self.content}
+
+
+def make_title(content: str) -> str:
+    return content[:TITLE_CHARS] + "..." if len(content) > TITLE_CHARS else content
+
+
+class Conversation:
+    """Messages of one conversation plus metadata kept up to date on write"""
+
+    __slots__ = (
+        "messages", "context", "created_at", "updated_at", "title", "message_count", "update_seq", "terms", "last_access", "nbytes",
+        "context_nbytes"
+    )
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.context: Any = None  # Prompt context owned by ChatService
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.title: Optional[str] = None  # From the first user message
+        self.message_count = 0  # Also set where messages are not loaded, e.g. listings from a shared store
+        self.update_seq = 0  # Position in the store's most-recently-updated order; 0 until the first message
+        self.terms: Set[str] = set()  # Search terms of all messages, for removal from the index
+        self.last_access = time.monotonic()
+        self.nbytes = sys.getsizeof(self)  # Messages plus the prompt context, as of the last sync_context_nbytes()
+        self.context_nbytes = 0
+
+    def sync_context_nbytes(self) -> int:
+        """Count the prompt context's current size in nbytes; returns the change.
+
+        The context holds its own copies of recent messages (window lines and
+        the rendered prefix) and changes outside the store, so stores call
+        this whenever they touch a conversation.
+        """
+        size = self.context.nbytes if self.context is not None else 0
+        delta = size - self.context_nbytes
+        self.context_nbytes = size
+        self.nbytes += delta
+        return delta
+
+
+def make_snippet(content: str, terms: Set[str], width: int = 120) -> str:
+    """Text of a message around the first occurrence of a search term"""
+    lowered = content.lower()
+    position = min((lowered.find(term) for term in terms if term in lowered), default=0)
+    start = max(0, position - width // 3)
+    return ("..." if start else "") + content[start:start + width]
+
+
+class ConversationStore:
+    """Bounded in-memory conversation store.
+
+    Conversations are kept in least-recently-used order and evicted when they
+    have been idle longer than idle_ttl, when there are more than
+    max_conversations, or when their messages exceed max_bytes in total.
+
+    Listing and search do not scan messages: each write moves the
+    conversation to the end of a sorted update order (used for cursor
+    pagination) and adds the message's terms to an inverted index.
+    """
+
+    def __init__(self, max_conversations: int = 1000, idle_ttl: float = 86400, max_bytes: int = 100 * 1024 * 1024):
+        self.max_conversations = max_conversations
+        self.idle_ttl = idle_ttl  # seconds
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._nbytes = 0
+        self._update_seq = 0
+        self._update_order: List[Tuple[int, str]] = []  # (update_seq, conversation_id), ascending
+        self._postings: Dict[str, Set[str]] = {}  # term -> conversation IDs
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return self._get(conversation_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    async def get(self, conversation_id: str) -> Optional[Conversation]:
+        """Return a conversation and mark it as recently used"""
+        return self._get(conversation_id)
+
+    async def get_or_create(self, conversation_id: str) -> Conversation:
+        return self._get_or_create(conversation_id)
+
+    def _get(self, conversation_id: str) -> Optional[Conversation]:
+        self._evict_idle()
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            conversation.last_access = time.monotonic()
+            self._conversations.move_to_end(conversation_id)
+            self._nbytes += conversation.sync_context_nbytes()
+        return conversation
+
+    def _get_or_create(self, conversation_id: str) -> Conversation:
+        conversation = self._get(conversation_id)
+        if conversation is None:
+            conversation = Conversation()
+            self._conversations[conversation_id] = conversation
+            self._nbytes += conversation.nbytes
+            self._evict_over_budget(keep=conversation_id)
+        return conversation
+
+    def add_message(self, conversation_id: str, role: str, content: str) -> Message:
+        """Append a message, evicting other conversations if over budget"""
+        conversation = self._get_or_create(conversation_id)
+        message = Message(role, content)
+        conversation.messages.append(message)
+        conversation.message_count += 1
+        conversation.nbytes += message.nbytes
+        self._nbytes += message.nbytes + conversation.sync_context_nbytes()
+        conversation.updated_at = time.time()
+        if conversation.title is None and role == "user":
+            conversation.title = make_title(content)
+        self._index_terms(conversation_id, conversation, content)
+        self._mark_updated(conversation_id, conversation)
+        self._evict_over_budget(keep=conversation_id)
+        return message
+
+    def delete(self, conversation_id: str) -> bool:
+        conversation = self._conversations.pop(conversation_id, None)
+        if conversation is None:
+            return False
+        self._nbytes -= conversation.nbytes
+        self._unlink_update(conversation)
+        for term in conversation.terms:
+            conversation_ids = self._postings.get(term)
+            if conversation_ids is not None:
+                conversation_ids.discard(conversation_id)
+                if not conversation_ids:
+                    del self._postings[term]
+        return True
+
+    async def flush(self):
+        """Nothing to commit; writes are applied immediately (see storage.create_conversation_store)"""
+
+    def recent(self, limit: int, before: Optional[int] = None) -> Tuple[List[Tuple[str, Conversation]], Optional[int]]:
+        """A page of conversations with messages, most recently updated first.
+
+        before is the cursor returned with the previous page; the returned
+        cursor is None on the last page.
+        """
+        self._evict_idle()
+        end = bisect_left(self._update_order, (before,)) if before is not None else len(self._update_order)
+        start = max(0, end - limit)
+        page = [(conversation_id, self._conversations[conversation_id]) for _, conversation_id in reversed(self._update_order[start:end])]
+        return page, (self._update_order[start][0] if start > 0 else None)
+
+    def search(self, query: str, limit: int, before: Optional[int] = None) -> Tuple[List[Tuple[str, Conversation]], Optional[int]]:
+        """A page of conversations containing every term of query, most recently updated first"""
+        self._evict_idle()
+        terms = set(tokenize(query))
+        if not terms:
+            return [], None
+        postings = sorted((self._postings.get(term, set()) for term in terms), key=len)
+        matches = postings[0].intersection(*postings[1:])
+        ranked = sorted(
+            ((self._conversations[conversation_id].update_seq, conversation_id) for conversation_id in matches),
+            reverse=True
+        )
+        if before is not None:
+            ranked = [entry for entry in ranked if entry[0] < before]
+        page = [(conversation_id, self._conversations[conversation_id]) for _, conversation_id in ranked[:limit]]
+        return page, (ranked[limit - 1][0] if len(ranked) > limit else None)
+
+    async def count_messages(self, conversation_id: str) -> int:
+        conversation = self._get(conversation_id)
+        return conversation.message_count if conversation is not None else 0
+
+    async def messages(self, conversation_id: str, start: int, stop: int) -> List[Message]:
+        """Messages [start, stop) of a conversation; only that slice is copied"""
+        conversation = self._get(conversation_id)
+        return conversation.messages[start:stop] if conversation is not None else []
+
+    def snippet(self, conversation_id: str, terms: Set[str], width: int = 120) -> str:
+        """Text around the first occurrence of a search term"""
+        conversation = self._conversations.get(conversation_id)
+        for message in conversation.messages if conversation is not None else []:
+            if terms.intersection(tokenize(message.content)):
+                return make_snippet(message.content, terms, width)
+        return ""
+
+    def _index_terms(self, conversation_id: str, conversation: Conversation, content: str):
+        for term in set(tokenize(content)) - conversation.terms:
+            conversation.terms.add(term)
+            self._postings.setdefault(term, set()).add(conversation_id)
+
+    def _mark_updated(self, conversation_id: str, conversation: Conversation):
+        self._unlink_update(conversation)
+        self._update_seq += 1
+        conversation.update_seq = self._update_seq
+        self._update_order.append((self._update_seq, conversation_id))
+
+    def _unlink_update(self, conversation: Conversation):
+        if conversation.update_seq:
+            index = bisect_left(self._update_order, (conversation.update_seq,))
+            del self._update_order[index]
+
+    def items(self) -> Iterator[Tuple[str, Conversation]]:
+        """Iterate conversations from least to most recently used"""
+        self._evict_idle()
+        return iter(list(self._conversations.items()))
+
+    def memory_usage(self) -> Dict:
+        """Approximate memory held by stored conversations"""
+        return {
+            "conversations": len(self._conversations),
+            "messages": sum(len(c.messages) for c in self._conversations.values()),
+            "bytes": self._nbytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
+
+    def _evict_idle(self):
+        # Oldest access first, so stop at the first conversation still fresh
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._conversations:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if conversation.last_access >= cutoff:
+                break
+            self._evict(conversation_id)
+
+    def _evict_over_budget(self, keep: str):
+        while self._conversations and (
+            len(self._conversations) > self.max_conversations or self._nbytes > self.max_bytes
+        ):
+            conversation_id = next(iter(self._conversations))
+            if conversation_id == keep:
+                # Only the active conversation is left; never evict it mid-request
+                break
+            self._evict(conversation_id)
+
+    def _evict(self, conversation_id: str):
+        self.delete(conversation_id)
+        self.evictions += 1
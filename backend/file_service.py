@@ -1,19 +1,111 @@
 import os
 import uuid
+import asyncio
+import hashlib
 import mimetypes
-from typing import Dict, Optional
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from fastapi import UploadFile, HTTPException
-import PyPDF2
 from io import BytesIO
-from dotenv import load_dotenv
 
-load_dotenv()
+from backend.metrics import FILE_EXTRACTION_BYTES, FILE_EXTRACTION_CACHE, FILE_EXTRACTION_LATENCY
+from backend.retrieval import RetrievalIndexCache, format_excerpts
+from backend.single_flight import SingleFlight
+from backend.startup import lazy_import, optional_import
+from backend.storage import create_file_store
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", min(4, os.cpu_count() or 1)))  # Also used for image normalization
+_worker_executor: Optional[Executor] = None
+
+
+def _pdf_page_count(content: bytes) -> int:
+    """Number of pages in a PDF (runs in the PDF worker pool)"""
+    return len(lazy_import("PyPDF2").PdfReader(BytesIO(content)).pages)
+
+
+def _pdf_pages_text(content: bytes, start: int, stop: int) -> List[str]:
+    """Extract text of pages [start, stop) of a PDF (runs in the PDF worker pool)"""
+    reader = lazy_import("PyPDF2").PdfReader(BytesIO(content))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _normalize_image(content: bytes, max_side: int, quality: int) -> Tuple[bytes, str, int, int]:
+    """Downscale an image to fit max_side and re-encode it (runs in the worker pool).
+
+    Returns the encoded bytes, their MIME type and the new width and height.
+    Images with transparency become PNG, everything else JPEG; animated
+    images keep their first frame.
+    """
+    image_module = lazy_import("PIL.Image")
+    image_ops = lazy_import("PIL.ImageOps")
+    with image_module.open(BytesIO(content)) as original:
+        # JPEGs can be decoded at a fraction of their size, which is much cheaper than resizing afterwards
+        original.draft("RGB", (max_side, max_side))
+        image = image_ops.exif_transpose(original)
+    image.thumbnail((max_side, max_side), image_module.Resampling.LANCZOS)
+    output = BytesIO()
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image.save(output, "PNG", optimize=True)
+        mime_type = "image/png"
+    else:
+        image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True)
+        mime_type = "image/jpeg"
+    return output.getvalue(), mime_type, image.width, image.height
+
+
+def _get_worker_executor() -> Executor:
+    """Process pool for PDF parsing and image normalization, or a thread pool where processes are unavailable"""
+    global _worker_executor
+    if _worker_executor is None:
+        if PDF_WORKERS > 0:
+            _worker_executor = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        else:
+            _worker_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf")
+    return _worker_executor
+
+
+async def _run_worker_task(func, *args):
+    """Run a CPU-bound PDF or image function off the event loop"""
+    global _worker_executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_worker_executor(), func, *args)
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        if isinstance(_worker_executor, ThreadPoolExecutor):
+            raise
+        # Serverless runtimes may not allow worker processes; fall back to threads
+        _worker_executor = ThreadPoolExecutor(max_workers=max(PDF_WORKERS, 1), thread_name_prefix="pdf")
+        return await loop.run_in_executor(_worker_executor, func, *args)
 
 class FileService:
     def __init__(self):
         self.max_file_size = int(os.getenv("MAX_FILE_SIZE", 10485760))  # 10MB default
+        self.form_overhead = 64 * 1024  # Multipart boundaries and headers allowed on top of max_file_size
         self.allowed_types = os.getenv("ALLOWED_FILE_TYPES", "txt,pdf,png,jpg,jpeg,gif,md,py,js,html,css,json").split(",")
-        self.file_storage = {}  # In-memory storage for serverless environment
+        self.chunk_size = 1024 * 1024  # Upload read size
+        self.spool_threshold = int(os.getenv("FILE_SPOOL_THRESHOLD", 1024 * 1024))  # Larger files spill to disk
+        # File metadata by file ID and content shared by identical uploads, in memory or in SQLite (see STORAGE_BACKEND)
+        self.store = create_file_store(self.spool_threshold)
+        # Extracted text by SHA-256, evicted least recently used first
+        self.extraction_cache: "OrderedDict[str, str]" = OrderedDict()
+        self.extraction_cache_chars = 0
+        self.max_extraction_cache_chars = int(os.getenv("EXTRACTION_CACHE_CHARS", 50 * 1024 * 1024))
+        self.pdf_workers = max(PDF_WORKERS, 1)
+        # Chunked BM25 indexes so questions about large files only send relevant excerpts
+        self.retrieval_indexes = RetrievalIndexCache(max_indexes=int(os.getenv("RETRIEVAL_INDEX_CACHE", 32)))
+        self.retrieval_min_chars = int(os.getenv("RETRIEVAL_MIN_CHARS", 8000))
+        self.retrieval_top_k = int(os.getenv("RETRIEVAL_TOP_K", 5))
+        self.min_pages_per_task = 4  # Smaller batches cost more in pickling than they save
+        # Images are downscaled and re-encoded once per content hash before being sent to the model
+        self.image_max_side = int(os.getenv("IMAGE_MAX_SIDE", 1536))
+        self.image_quality = int(os.getenv("IMAGE_JPEG_QUALITY", 85))
+        self.image_cache: "OrderedDict[str, Tuple[bytes, str, Optional[int], Optional[int]]]" = OrderedDict()
+        self.image_cache_bytes = 0
+        self.max_image_cache_bytes = int(os.getenv("IMAGE_CACHE_BYTES", 64 * 1024 * 1024))
+        self.image_in_flight = SingleFlight()
     
     def _get_file_type(self, filename: str) -> str:
         """Get file type from filename extension."""
@@ -23,17 +115,7 @@ class FileService:
         return "unknown"
     
     async def validate_file(self, file: UploadFile) -> Dict:
-        """Validate uploaded file"""
-        # Check file size
-        file_content = await file.read()
-        await file.seek(0)  # Reset file pointer
-        
-        if len(file_content) > self.max_file_size:
-            raise HTTPException(
-                status_code=413, 
-                detail=f"File too large. Maximum size is {self.max_file_size / 1024 / 1024:.1f}MB"
-            )
-        
+        """Validate uploaded file metadata; size is enforced while saving"""
         # Check file type
         file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else ''
         if file_extension not in self.allowed_types:
@@ -41,66 +123,332 @@ class FileService:
         
         return {
             "valid": True,
-            "size": len(file_content),
             "type": file_extension,
             "filename": file.filename
         }
     
+    def check_upload_length(self, content_length: Optional[str]):
+        """Reject an upload whose declared Content-Length cannot fit max_file_size.
+
+        Parsing the form spools the whole body first, so this must run before
+        it; save_file() still enforces the limit on what is actually read.
+        """
+        if content_length and content_length.isdigit() and int(content_length) > self.max_file_size + self.form_overhead:
+            raise self._too_large()
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size is {self.max_file_size / 1024 / 1024:.1f}MB"
+        )
+
     async def save_file(self, file: UploadFile) -> str:
-        """Save uploaded file content in memory for serverless environment"""
+        """Stream uploaded file into spooled storage in a single pass.
+
+        The upload is read in chunks, hashed as it streams and aborted as soon
+        as it exceeds max_file_size. Small files stay in memory, larger ones
+        spill to a temporary file on disk. Re-uploads of identical content
+        share the stored bytes and their cached extraction.
+        """
         file_id = str(uuid.uuid4())
-        content = await file.read()
+        blob = self.store.new_blob()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            while True:
+                chunk = await file.read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_file_size:
+                    raise self._too_large()
+                digest.update(chunk)
+                blob.write(chunk)
+        except Exception:
+            blob.close()
+            raise
         
-        # Store file content and metadata in memory
-        self.file_storage[file_id] = {
-            "content": content,
+        await self.store.add(file_id, {
             "filename": file.filename,
             "content_type": file.content_type,
-            "size": len(content)
-        }
+            "size": size,
+            "sha256": digest.hexdigest()
+        }, blob)
         
         return file_id
     
-    async def extract_content(self, file_id: str) -> str:
-        """Extract text content from file stored in memory"""
-        if file_id not in self.file_storage:
+    async def get_file_info(self, file_id: str) -> Dict:
+        """Get stored file metadata"""
+        file_info = self.store.get(file_id)
+        if file_info is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        return dict(file_info)
+    
+    async def extract_content(self, file_id: str, page_range: Optional[Tuple[int, int]] = None) -> str:
+        """Extract text content from a stored file, memoized by content hash.
+
+        page_range limits PDF extraction to (first, last) pages, 1-based and inclusive.
+        """
+        file_info = self.store.get(file_id)
+        if file_info is None:
             raise HTTPException(status_code=404, detail="File not found")
         
-        file_info = self.file_storage[file_id]
-        content = file_info["content"]
         content_type = file_info["content_type"]
         filename = file_info["filename"]
+        sha256 = file_info["sha256"]
         
         try:
-            if content_type == "application/pdf" or (filename and filename.endswith('.pdf')):
-                return await self._extract_pdf_content(content)
-            elif content_type and content_type.startswith("text/"):
-                return content.decode('utf-8', errors='ignore')
-            elif filename and filename.endswith(('.py', '.js', '.html', '.css', '.json', '.md', '.txt')):
-                return content.decode('utf-8', errors='ignore')
-            elif content_type and content_type.startswith("image/"):
-                return f"[Image file: {filename}] - Image analysis not implemented in this demo"
+            is_pdf = content_type == "application/pdf" or (filename and filename.endswith('.pdf'))
+            if is_pdf or self._is_text(file_info):
+                cache_key = self._extraction_key(sha256, is_pdf, page_range)
+                text = self._get_cached_extraction(cache_key)
+                if text is not None:
+                    FILE_EXTRACTION_CACHE.inc(result="hit")
+                    return text
+                FILE_EXTRACTION_CACHE.inc(result="miss")
+                
+                kind = "pdf" if is_pdf else "text"
+                start = time.perf_counter()
+                content = await self.store.read(sha256)
+                FILE_EXTRACTION_BYTES.inc(len(content), kind=kind)
+                try:
+                    if is_pdf:
+                        try:
+                            text = await self._extract_pdf_content(content, page_range)
+                        except Exception as e:
+                            return f"Error reading PDF: {str(e)}"
+                    else:
+                        text = content.decode('utf-8', errors='ignore')
+                finally:
+                    FILE_EXTRACTION_LATENCY.observe(time.perf_counter() - start, kind=kind)
+                self._cache_extraction(cache_key, text)
+                return text
+            elif self.is_image(file_info):
+                _, _, width, height = await self._normalized_image(file_info)
+                size = f" ({width}x{height})" if width else ""
+                return f"[Image file: {filename}{size}] - sent to the model as an image"
             else:
                 return f"[File: {filename}] - Content extraction not supported for this file type"
         except Exception as e:
             return f"Error extracting content: {str(e)}"
     
-    async def _extract_pdf_content(self, content: bytes) -> str:
-        """Extract content from PDF files stored in memory"""
+    async def _extract_pdf_content(self, content: bytes, page_range: Optional[Tuple[int, int]] = None) -> str:
+        """Extract content from PDF files, with pages split across the worker pool"""
+        batches = await self._pdf_batches(content, page_range)
+        results = await asyncio.gather(*(_run_worker_task(_pdf_pages_text, content, start, stop) for start, stop in batches))
+        # Join once at the end instead of growing a string page by page
+        return "\n".join(page for pages in results for page in pages).strip()
+    
+    async def iter_pdf_pages(self, file_id: str, page_range: Optional[Tuple[int, int]] = None) -> AsyncIterator[str]:
+        """Yield the text of a stored PDF page by page, as soon as each batch is parsed.
+
+        Batches are small and submitted lazily, at most one per worker ahead of
+        the reader, so a caller that stops early (a preview) does not leave the
+        rest of the document being parsed. A document read to the end is cached
+        like a full extraction.
+        """
+        file_info = self.store.get(file_id)
+        if file_info is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        content = await self.store.read(file_info["sha256"])
+        batches = iter(await self._pdf_batches(content, page_range, batch_size=self.min_pages_per_task))
+        
+        def submit():
+            batch = next(batches, None)
+            if batch is not None:
+                tasks.append(asyncio.ensure_future(_run_worker_task(_pdf_pages_text, content, *batch)))
+        
+        tasks: List[asyncio.Future] = []
+        pages: List[str] = []
+        for _ in range(self.pdf_workers):
+            submit()
+        try:
+            while tasks:
+                batch_pages = await tasks.pop(0)
+                submit()
+                for page in batch_pages:
+                    pages.append(page)
+                    yield page
+        finally:
+            for task in tasks:
+                task.cancel()
+        self._cache_extraction(self._extraction_key(file_info["sha256"], True, page_range), "\n".join(pages).strip())
+    
+    async def _pdf_batches(self, content: bytes, page_range: Optional[Tuple[int, int]],
+                           batch_size: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Split the requested pages into contiguous [start, stop) batches, one per worker unless batch_size is given"""
+        page_count = await _run_worker_task(_pdf_page_count, content)
+        start, stop = 0, page_count
+        if page_range:
+            start = max(page_range[0] - 1, 0)
+            stop = min(page_range[1], page_count)
+        if start >= stop:
+            return []
+        batch_size = batch_size or max(self.min_pages_per_task, -(-(stop - start) // self.pdf_workers))
+        return [(first, min(first + batch_size, stop)) for first in range(start, stop, batch_size)]
+    
+    def parse_page_range(self, value: Optional[str]) -> Optional[Tuple[int, int]]:
+        """Parse a page range such as "3-10" or "5" into (first, last)"""
+        if not value:
+            return None
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(content))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text.strip()
+            first, _, last = value.strip().partition("-")
+            first_page = int(first)
+            last_page = int(last) if last else first_page
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid page range '{value}'")
+        if first_page < 1 or last_page < first_page:
+            raise HTTPException(status_code=400, detail=f"Invalid page range '{value}'")
+        return first_page, last_page
+    
+    def _is_text(self, file_info: Dict) -> bool:
+        content_type = file_info["content_type"]
+        filename = file_info["filename"]
+        return bool((content_type and content_type.startswith("text/")) or (
+            filename and filename.endswith(('.py', '.js', '.html', '.css', '.json', '.md', '.txt'))
+        ))
+    
+    async def get_preview(self, file_id: str, max_chars: int = 500) -> str:
+        """Short preview of a file's text; text files read only their first bytes, PDFs stop parsing after the first pages"""
+        file_info = await self.get_file_info(file_id)
+        filename = file_info["filename"]
+        is_pdf = file_info["content_type"] == "application/pdf" or (filename and filename.endswith('.pdf'))
+        limit = max_chars * 4  # UTF-8 takes at most 4 bytes per character
+        if (not is_pdf and self._is_text(file_info) and file_info["size"] > limit
+                and self._get_cached_extraction(f"{file_info['sha256']}:text") is None):
+            # A partial character at the cut is dropped by errors="ignore"
+            content = (await self.store.read(file_info["sha256"], limit)).decode('utf-8', errors='ignore')
+            return content[:max_chars] + "..."
+        elif not is_pdf or self._get_cached_extraction(f"{file_info['sha256']}:pdf") is not None:
+            content = await self.extract_content(file_id)
+        else:
+            pages = []
+            length = 0
+            page_iter = self.iter_pdf_pages(file_id)
+            try:
+                async for page in page_iter:
+                    pages.append(page)
+                    length += len(page) + 1
+                    if length > max_chars:
+                        break
+            except Exception as e:
+                return f"Error reading PDF: {str(e)}"
+            finally:
+                # Stops submitting the remaining pages
+                await page_iter.aclose()
+            content = "\n".join(pages).strip()
+        return content[:max_chars] + "..." if len(content) > max_chars else content
+    
+    async def get_relevant_content(self, file_id: str, query: str, page_range: Optional[Tuple[int, int]] = None, k: Optional[int] = None) -> str:
+        """File text relevant to a question: small files whole, large ones as top-k BM25 excerpts"""
+        text = await self.extract_content(file_id, page_range)
+        if len(text) <= self.retrieval_min_chars:
+            return text
+        
+        file_info = await self.get_file_info(file_id)
+        filename = file_info["filename"]
+        is_pdf = file_info["content_type"] == "application/pdf" or (filename and filename.endswith('.pdf'))
+        key = self._extraction_key(file_info["sha256"], is_pdf, page_range)
+        # Chunking and indexing a large document is CPU-bound; keep it off the event loop
+        index = await asyncio.to_thread(self.retrieval_indexes.get, text, key)
+        return format_excerpts(index.top_chunks(query, k or self.retrieval_top_k))
+    
+    def is_image(self, file_info: Dict) -> bool:
+        content_type = file_info["content_type"] or mimetypes.guess_type(file_info["filename"] or "")[0] or ""
+        return content_type.startswith("image/")
+    
+    async def get_image_part(self, file_id: str) -> Dict:
+        """A stored image as a model input part ({"mime_type", "data"}), downscaled to IMAGE_MAX_SIDE"""
+        file_info = await self.get_file_info(file_id)
+        if not self.is_image(file_info):
+            raise HTTPException(status_code=400, detail="File is not an image")
+        try:
+            data, mime_type, _, _ = await self._normalized_image(file_info)
         except Exception as e:
-            return f"Error reading PDF: {str(e)}"
+            raise HTTPException(status_code=400, detail=f"Could not read image: {str(e)}")
+        return {"mime_type": mime_type, "data": data}
+    
+    async def _normalized_image(self, file_info: Dict) -> Tuple[bytes, str, Optional[int], Optional[int]]:
+        key = f"{file_info['sha256']}:{self.image_max_side}:{self.image_quality}"
+        cached = self.image_cache.get(key)
+        if cached is not None:
+            self.image_cache.move_to_end(key)
+            FILE_EXTRACTION_CACHE.inc(result="hit")
+            return cached
+        FILE_EXTRACTION_CACHE.inc(result="miss")
+        
+        async def normalize():
+            content = await self.store.read(file_info["sha256"])
+            start = time.perf_counter()
+            FILE_EXTRACTION_BYTES.inc(len(content), kind="image")
+            try:
+                if optional_import("PIL.Image") is None:
+                    # Fallback for installs without Pillow (it is in requirements.txt): send formats the model reads natively as uploaded
+                    content_type = file_info["content_type"] or mimetypes.guess_type(file_info["filename"] or "")[0]
+                    if content_type not in ("image/png", "image/jpeg", "image/webp"):
+                        raise ValueError(f"Converting {content_type} images requires the Pillow package")
+                    return content, content_type, None, None
+                return await _run_worker_task(_normalize_image, content, self.image_max_side, self.image_quality)
+            finally:
+                FILE_EXTRACTION_LATENCY.observe(time.perf_counter() - start, kind="image")
+        
+        # Questions about a new upload often arrive together; normalize it once
+        image, shared = await self.image_in_flight.do(key, normalize)
+        if not shared:
+            self._cache_image(key, image)
+        return image
+    
+    def _cache_image(self, key: str, image: Tuple[bytes, str, Optional[int], Optional[int]]):
+        size = len(image[0])
+        if size > self.max_image_cache_bytes:
+            return
+        previous = self.image_cache.pop(key, None)
+        if previous is not None:
+            self.image_cache_bytes -= len(previous[0])
+        self.image_cache[key] = image
+        self.image_cache_bytes += size
+        while self.image_cache_bytes > self.max_image_cache_bytes:
+            _, evicted = self.image_cache.popitem(last=False)
+            self.image_cache_bytes -= len(evicted[0])
+    
+    def _extraction_key(self, sha256: str, is_pdf: bool, page_range: Optional[Tuple[int, int]]) -> str:
+        if not is_pdf:
+            return f"{sha256}:text"
+        if page_range:
+            return f"{sha256}:pdf:{page_range[0]}-{page_range[1]}"
+        return f"{sha256}:pdf"
+    
+    def _get_cached_extraction(self, cache_key: str) -> Optional[str]:
+        text = self.extraction_cache.get(cache_key)
+        if text is not None:
+            self.extraction_cache.move_to_end(cache_key)
+        return text
+    
+    def _cache_extraction(self, cache_key: str, text: str):
+        if len(text) > self.max_extraction_cache_chars:
+            return
+        previous = self.extraction_cache.pop(cache_key, None)
+        if previous is not None:
+            self.extraction_cache_chars -= len(previous)
+        self.extraction_cache[cache_key] = text
+        self.extraction_cache_chars += len(text)
+        while self.extraction_cache_chars > self.max_extraction_cache_chars:
+            _, evicted = self.extraction_cache.popitem(last=False)
+            self.extraction_cache_chars -= len(evicted)
+    
+    def _drop_cached_extractions(self, sha256: str):
+        for cache_key in [key for key in self.extraction_cache if key.startswith(f"{sha256}:")]:
+            self.extraction_cache_chars -= len(self.extraction_cache.pop(cache_key))
+        for cache_key in [key for key in self.image_cache if key.startswith(f"{sha256}:")]:
+            self.image_cache_bytes -= len(self.image_cache.pop(cache_key)[0])
+        self.retrieval_indexes.discard(f"{sha256}:")
     
-    async def get_file_content(self, file_id: str) -> str:
+    async def get_file_content(self, file_id: str, page_range: Optional[Tuple[int, int]] = None) -> str:
         """Get file content by file ID"""
-        return await self.extract_content(file_id)
+        return await self.extract_content(file_id, page_range)
     
     async def delete_file(self, file_id: str):
-        """Delete file from storage"""
-        if file_id in self.file_storage:
-            del self.file_storage[file_id]
\ No newline at end of file
+        """Delete file from storage, releasing its content once no upload references it"""
+        sha256 = await self.store.delete(file_id)
+        if sha256 is not None:
+            self._drop_cached_extractions(sha256)
\ No newline at end of file
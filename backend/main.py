@@ -1,17 +1,23 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+import time
+
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 import os
+import asyncio
 import json
 import uuid
 from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel
+from starlette.datastructures import UploadFile as StarletteUploadFile
 
-from backend.chat_service import ChatService
-from backend.file_service import FileService
-from backend.research_agent import ResearchAgent
+from backend import metrics, services, startup
+from backend.compression import JSONGzipMiddleware
+from backend.model_client import ModelCallError, get_model_client
 
 app = FastAPI(title="Enkay LLM ChatClone", version="1.0.0")
 
@@ -24,16 +30,134 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-chat_service = ChatService()
-file_service = FileService()
-research_agent = ResearchAgent()
+# Request latency per route for /api/metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Large JSON bodies such as conversation history are sent gzip-compressed
+app.add_middleware(JSONGzipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", 1024)))
+
+# Hashed, precompressed frontend assets for local/container mode; Vercel serves them itself
+static_assets = None
+if os.getenv("VERCEL") != "1":
+    from backend.static_assets import StaticAssets
+    # Rebuilt when a file changes only in development; otherwise loaded once at startup
+    static_assets = StaticAssets("frontend", watch=os.getenv("STATIC_ASSETS_WATCH", "false").lower() == "true")
 
+# Bounds for /api/chat/batch
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", 8))
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", 500))
+
+# Services are built on first use (see backend/services.py) to keep cold starts short
+
+def _service_gauge(name: str, read):
+    """Gauge callback reporting nothing until the service exists, so scrapes do not build it"""
+    def callback():
+        service = services.loaded(name)
+        return read(service) if service is not None else {}
+    return callback
+
+def _response_cache_gauge(read):
+    def callback():
+        values = {"model": read(get_model_client().cache)}
+        research_agent = services.loaded("research")
+        if research_agent is not None:
+            values.update(
+                research_terms=read(research_agent.search_terms_cache),
+                research_results=read(research_agent.search_results_cache),
+                research_analysis=read(research_agent.analysis_cache)
+            )
+        return values
+    return callback
+
+# Store sizes, read at scrape time
+metrics.CallbackGauge(
+    "conversation_store_size", "Conversation store usage",
+    _service_gauge("chat", lambda chat_service: {
+        key: value for key, value in chat_service.conversations.memory_usage().items() if key != "max_bytes"
+    }),
+    ["measure"]
+)
+metrics.CallbackGauge(
+    "file_store_size", "File store usage",
+    _service_gauge("files", lambda file_service: {
+        **file_service.store.stats(),
+        "extraction_cache_entries": len(file_service.extraction_cache),
+        "extraction_cache_chars": file_service.extraction_cache_chars,
+        "image_cache_entries": len(file_service.image_cache),
+        "image_cache_bytes": file_service.image_cache_bytes
+    }),
+    ["measure"]
+)
+metrics.CallbackGauge(
+    "response_cache_size", "Cached model responses per cache",
+    _response_cache_gauge(lambda cache: cache.stats()["entries"]),
+    ["cache"]
+)
+metrics.CallbackGauge(
+    "response_cache_hits", "Response cache hits per cache",
+    _response_cache_gauge(lambda cache: cache.hits),
+    ["cache"]
+)
+metrics.CallbackGauge(
+    "response_cache_misses", "Response cache misses per cache",
+    _response_cache_gauge(lambda cache: cache.misses),
+    ["cache"]
+)
+def _similarity_cache_gauge(read):
+    """Per-cache values of the near-duplicate caches that are enabled and built"""
+    def callback():
+        values = {}
+        for name in ("chat", "research"):
+            service = services.loaded(name)
+            cache = getattr(service, "similarity_cache", None)
+            if cache is not None:
+                values[name] = read(cache)
+        return values
+    return callback
+
+metrics.CallbackGauge(
+    "similarity_cache_size", "Entries in the near-duplicate prompt caches",
+    _similarity_cache_gauge(lambda cache: cache.stats()["entries"]),
+    ["cache"]
+)
+metrics.CallbackGauge(
+    "similarity_cache_hit_ratio", "Exact and near hits over all near-duplicate cache lookups",
+    _similarity_cache_gauge(lambda cache: cache.stats()["hit_rate"]),
+    ["cache"]
+)
+metrics.CallbackGauge(
+    "similarity_cache_suspected_false_hits", "Audited near hits whose fresh answer differed from the cached one",
+    _similarity_cache_gauge(lambda cache: cache.suspected_false_hits),
+    ["cache"]
+)
+metrics.CallbackGauge(
+    "model_rate_limiter", "Shared Gemini rate limiter state (AIMD fraction, effective limits, queue)",
+    lambda: get_model_client().limiter.stats(),
+    ["measure"]
+)
+metrics.CallbackGauge(
+    "model_circuit_breaker", "Gemini circuit breaker state (open, half_open, failures, opens, rejected calls)",
+    lambda: get_model_client().breaker.stats(),
+    ["measure"]
+)
+metrics.CallbackGauge(
+    "model_hedge_delay_seconds", "Delay after which a slow Gemini call is hedged, per call site (empty until hedging has enough samples)",
+    lambda: {
+        call_site: delay for call_site in get_model_client().latencies.keys()
+        if (delay := get_model_client().hedge_delay(call_site)) is not None
+    },
+    ["call_site"]
+)
 
 class ChatMessage(BaseModel):
     message: str
     conversation_id: Optional[str] = None
     use_research: bool = False
+    fresh: bool = False  # Bypass cached research results and near-duplicate answers
+
+class ChatBatchRequest(BaseModel):
+    items: List[ChatMessage]
+    concurrency: Optional[int] = None  # Lowers the server's CHAT_BATCH_CONCURRENCY for this batch
 
 class ChatResponse(BaseModel):
     response: str
@@ -41,8 +165,10 @@ class ChatResponse(BaseModel):
     timestamp: str
 
 @app.get("/")
-async def read_root():
+async def read_root(request: Request):
     try:
+        if static_assets is not None:
+            return await static_assets.index_response(request)
         return FileResponse("frontend/index.html")
     except Exception:
         # Fallback HTML in case file is not accessible in serverless runtime
@@ -60,18 +186,24 @@ async def read_root():
             status_code=200
         )
 
+def _sse(event: str, data: dict) -> str:
+    """Format a Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _chat_reply(message: ChatMessage, conversation_id: str, raise_errors: bool = False) -> str:
+    if message.use_research:
+        return await services.get_research_agent().research_and_respond(
+            message.message, use_cache=not message.fresh, raise_errors=raise_errors
+        )
+    return await services.get_chat_service().get_response(
+        message.message, conversation_id, use_cache=not message.fresh, raise_errors=raise_errors
+    )
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(message: ChatMessage):
+    conversation_id = message.conversation_id or str(uuid.uuid4())
     try:
-        if message.use_research:
-            response = await research_agent.research_and_respond(message.message)
-        else:
-            response = await chat_service.get_response(
-                message.message, 
-                message.conversation_id
-            )
-        
-        conversation_id = message.conversation_id or str(uuid.uuid4())
+        response = await _chat_reply(message, conversation_id)
         
         return ChatResponse(
             response=response,
@@ -80,55 +212,157 @@ async def chat(message: ChatMessage):
         )
     except Exception as e:
         # Return friendly fallback instead of 500 to avoid FUNCTION_INVOCATION_FAILED
-        conversation_id = message.conversation_id or str(uuid.uuid4())
         return ChatResponse(
             response=f"I'm sorry, I ran into an issue: {str(e)}. Please try again.",
             conversation_id=conversation_id,
             timestamp=datetime.now().isoformat()
         )
 
+@app.post("/api/chat/stream")
+async def chat_stream(message: ChatMessage):
+    """Stream the chat response as Server-Sent Events.
+
+    Emits `token` events with text deltas followed by a single `done` event
+    carrying the conversation ID and timestamp.
+    """
+    conversation_id = message.conversation_id or str(uuid.uuid4())
+
+    async def event_stream():
+        try:
+            if message.use_research:
+                response = await services.get_research_agent().research_and_respond(message.message, use_cache=not message.fresh)
+                yield _sse("token", {"text": response})
+            else:
+                async for token in services.get_chat_service().stream_response(message.message, conversation_id, use_cache=not message.fresh):
+                    yield _sse("token", {"text": token})
+        except Exception as e:
+            yield _sse("token", {"text": f"I'm sorry, I ran into an issue: {str(e)}. Please try again."})
+        yield _sse("done", {"conversation_id": conversation_id, "timestamp": datetime.now().isoformat()})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/chat/batch")
+async def chat_batch(batch: ChatBatchRequest):
+    """Answer many independent messages in one request, streamed back as NDJSON.
+
+    Items run concurrently up to CHAT_BATCH_CONCURRENCY and each result line
+    is written as soon as it finishes, so lines arrive in completion order and
+    carry the item's index. A failed item, including one the model could not
+    answer, yields a line with "error" and "error_kind" fields instead of
+    failing the batch. Items sharing a conversation_id run one
+    after another in their batch order.
+    """
+    if len(batch.items) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {CHAT_BATCH_MAX_ITEMS} items")
+    semaphore = asyncio.Semaphore(max(1, min(batch.concurrency or CHAT_BATCH_CONCURRENCY, CHAT_BATCH_CONCURRENCY)))
+    conversation_locks = {}
+
+    async def run_item(index: int, item: ChatMessage, conversation_id: str) -> dict:
+        async with conversation_locks[conversation_id], semaphore:
+            try:
+                response = await _chat_reply(item, conversation_id, raise_errors=True)
+            except ModelCallError as e:
+                return {
+                    "index": index, "conversation_id": conversation_id,
+                    "error": services.get_chat_service().chat_error_message(e), "error_kind": e.kind
+                }
+            except Exception as e:
+                return {"index": index, "conversation_id": conversation_id, "error": str(e), "error_kind": "other"}
+            return {
+                "index": index,
+                "conversation_id": conversation_id,
+                "response": response,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    async def results():
+        tasks = []
+        for index, item in enumerate(batch.items):
+            conversation_id = item.conversation_id or str(uuid.uuid4())
+            conversation_locks.setdefault(conversation_id, asyncio.Lock())
+            tasks.append(asyncio.create_task(run_item(index, item, conversation_id)))
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            # Client went away: stop the remaining items
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(request: Request):
+    """Upload one file as the multipart field "file" """
+    file_service = services.get_file_service()
+    # Parsing the form spools the whole body, so an oversized upload is refused on its Content-Length first
+    file_service.check_upload_length(request.headers.get("content-length"))
+    form = await request.form(max_files=1)
+    file = form.get("file")
+    if not isinstance(file, StarletteUploadFile):
+        await form.close()
+        raise HTTPException(status_code=422, detail="Missing file field 'file'")
     try:
-        # Validate file
-        file_info = await file_service.validate_file(file)
+        # Validate file type before storing anything
+        await file_service.validate_file(file)
         
-        # Save file (in-memory) and get its ID
+        # Stream file into storage (size enforced while reading) and get its ID
         file_id = await file_service.save_file(file)
+        file_info = await file_service.get_file_info(file_id)
         
-        # Process file content from in-memory storage
-        content = await file_service.extract_content(file_id)
+        # Preview only needs the first pages of large documents
+        content_preview = await file_service.get_preview(file_id, max_chars=500)
         
         return {
             "filename": file.filename,
             "file_id": file_id,
-            "content_preview": content[:500] + "..." if len(content) > 500 else content,
+            "content_preview": content_preview,
             "file_type": file.content_type,
             "size": file_info["size"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await form.close()
 
 @app.post("/api/chat-with-file")
 async def chat_with_file(
     message: str = Form(...),
     file_id: str = Form(...),
     conversation_id: Optional[str] = Form(None),
-    use_research: bool = Form(False)
+    use_research: bool = Form(False),
+    page_range: Optional[str] = Form(None),
+    fresh: bool = Form(False)
 ):
+    file_service = services.get_file_service()
+    # Assigned before the call, so the ID returned is the one the history is stored under
+    conversation_id = conversation_id or str(uuid.uuid4())
     try:
-        # Get file content
-        file_content = await file_service.get_file_content(file_id)
-        
-        # Combine message with file content
-        full_message = f"User message: {message}\n\nFile content:\n{file_content}"
+        file_info = await file_service.get_file_info(file_id)
+        attachments = None
+        if file_service.is_image(file_info):
+            # The image itself goes to the model, downscaled; web research only sees the message
+            attachments = [await file_service.get_image_part(file_id)]
+            full_message = f"User message: {message}\n\nAttached image: {file_info['filename']}"
+        else:
+            # Get the parts of the file relevant to the message, optionally limited to a page range such as "3-10"
+            file_content = await file_service.get_relevant_content(file_id, message, file_service.parse_page_range(page_range))
+            
+            # Combine message with file content
+            full_message = f"User message: {message}\n\nFile content:\n{file_content}"
         
         if use_research:
-            response = await research_agent.research_and_respond(full_message)
+            response = await services.get_research_agent().research_and_respond(full_message, use_cache=not fresh)
         else:
-            response = await chat_service.get_response(full_message, conversation_id)
-        
-        conversation_id = conversation_id or str(uuid.uuid4())
+            response = await services.get_chat_service().get_response(
+                full_message, conversation_id, use_cache=not fresh, attachments=attachments
+            )
         
         return ChatResponse(
             response=response,
@@ -138,27 +372,150 @@ async def chat_with_file(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/analyze-file")
+async def analyze_file(
+    file_id: str = Form(...),
+    question: Optional[str] = Form(None),
+    page_range: Optional[str] = Form(None),
+    map_reduce: Optional[bool] = Form(None),
+    stream: bool = Form(False),
+    fresh: bool = Form(False)
+):
+    """Summarize a file, or answer a question about it.
+
+    Files too large for one prompt are analyzed in parallel chunks and the
+    partial results combined. With stream=true the response is NDJSON:
+    progress events, each chunk's notes as it completes, then the result.
+    """
+    file_service = services.get_file_service()
+    chat_service = services.get_chat_service()
+    file_info = await file_service.get_file_info(file_id)
+    filename = file_info["filename"]
+
+    if file_service.is_image(file_info):
+        image = await file_service.get_image_part(file_id)
+        analysis = await chat_service.analyze_image(image, filename, question, use_cache=not fresh)
+        if not stream:
+            return {"file_id": file_id, "analysis": analysis}
+        return StreamingResponse(
+            iter([json.dumps({"type": "result", "text": analysis, "chunks": 1}) + "\n"]), media_type="application/x-ndjson"
+        )
+
+    content = await file_service.extract_content(file_id, file_service.parse_page_range(page_range))
+
+    if not stream:
+        analysis = await chat_service.analyze_file_content(content, filename, question, use_cache=not fresh, map_reduce=map_reduce)
+        return {"file_id": file_id, "analysis": analysis}
+
+    async def events():
+        if not chat_service.model:
+            yield json.dumps({"type": "error", "message": "AI service is not configured for file analysis. Please set GEMINI_API_KEY."}) + "\n"
+            return
+        try:
+            async for event in chat_service.iter_file_analysis(content, filename, question, use_cache=not fresh, map_reduce=map_reduce):
+                yield json.dumps(event) + "\n"
+        except ModelCallError as e:
+            yield json.dumps({"type": "error", "message": chat_service.file_analysis_error(e, filename)}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+def _parse_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        return int(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/api/conversations")
+async def list_conversations(limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None):
+    """Conversation metadata, most recently updated first; pass next_cursor back as cursor for the next page"""
+    return await services.get_chat_service().list_conversations(limit, _parse_cursor(cursor))
+
+@app.get("/api/conversations/search")
+async def search_conversations(q: str, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None):
+    """Conversations whose messages contain every keyword in q"""
+    return await services.get_chat_service().search_conversations(q, limit, _parse_cursor(cursor))
+
 @app.get("/api/conversations/{conversation_id}")
-async def get_conversation(conversation_id: str):
+async def get_conversation(conversation_id: str, limit: Optional[int] = Query(None, ge=1, le=500),
+                           before: Optional[str] = None, after: Optional[str] = None):
+    """Conversation history.
+
+    With limit, before or after, returns one page of messages: the latest
+    limit (default 50), or those just before/after a cursor, plus
+    prev_cursor/next_cursor. Without them, returns the whole history.
+    """
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Pass either before or after, not both")
+    chat_service = services.get_chat_service()
+    if limit is not None or before is not None or after is not None:
+        return await chat_service.get_history_page(conversation_id, limit or 50, _parse_cursor(before), _parse_cursor(after))
     try:
         messages = await chat_service.get_conversation_history(conversation_id)
         return {"messages": messages}
     except Exception as e:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
+@app.get("/api/conversations/{conversation_id}/export")
+async def export_conversation(conversation_id: str):
+    """Stream the whole history as NDJSON, one message per line, without building it in memory"""
+    async def lines():
+        async for message in services.get_chat_service().iter_history(conversation_id):
+            yield json.dumps(message) + "\n"
+
+    filename = "".join(c if c.isalnum() or c in "-_" else "_" for c in conversation_id)
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="conversation-{filename}.ndjson"'}
+    )
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    app.state.loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    if static_assets is not None:
+        # Hash and compress the frontend before the first page load
+        await static_assets.refresh()
+
+@app.on_event("shutdown")
+async def close_clients():
+    app.state.loop_monitor.cancel()
+    research_agent = services.loaded("research")
+    if research_agent is not None:
+        await research_agent.aclose()
+
 @app.get("/api/ping")
 async def ping():
     return {"ok": True}
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Prometheus text exposition of latency histograms, retry counters and store sizes"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/diagnostics/startup")
+async def startup_report():
+    """How long the app took to import and which lazy imports and services have been loaded since"""
+    return startup.report()
+
 # Serve static files
 # Static files mounting for local development
-if os.getenv("VERCEL") != "1":
-    app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
+if static_assets is not None:
+    @app.get("/static/{path:path}")
+    async def static_file(path: str, request: Request):
+        response = await static_assets.static_response(request, path)
+        if response is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        return response
+
     app.mount("/", StaticFiles(directory="frontend", html=True), name="frontend")
 
 # Vercel handler
 handler = app
 
+startup.record_app_import(time.perf_counter() - _import_started)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,217 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Union
+
+# Latency buckets in seconds, from fast cache hits up to slow upstream calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class for metrics rendered in the Prometheus text format.
+
+    Metrics are updated from the event loop thread only, so no locking is done.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.register(self)
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type_name}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts, then sum and count
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}"
+
+
+class CallbackGauge(Metric):
+    """Gauge whose value is read from a callback at scrape time.
+
+    The callback returns either a number or a dict of label value -> number
+    when the gauge has a single label.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], Union[float, Dict[str, float]]], labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self) -> Iterator[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            return
+        if isinstance(value, dict):
+            for label, number in value.items():
+                yield f"{self.name}{_format_labels(self.labelnames, (label,))} {number}"
+        else:
+            yield f"{self.name} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response body completes", ["method", "route", "status"]
+)
+MODEL_CALL_LATENCY = Histogram(
+    "model_call_duration_seconds", "Gemini call duration per call site, including retries", ["call_site", "outcome"]
+)
+MODEL_CALL_RETRIES = Counter(
+    "model_call_retries_total", "Gemini call retries per call site and error kind", ["call_site", "kind"]
+)
+MODEL_CALL_HEDGES = Counter(
+    "model_call_hedges_total", "Duplicate Gemini requests sent for slow attempts, and how many answered first", ["call_site", "result"]
+)
+MODEL_CALL_COALESCED = Counter(
+    "model_call_coalesced_total", "Calls served by an identical in-flight Gemini request", ["call_site"]
+)
+RESEARCH_STAGE_LATENCY = Histogram(
+    "research_stage_duration_seconds", "Research pipeline stage duration", ["stage"]
+)
+SIMILARITY_CACHE_LOOKUPS = Counter(
+    "similarity_cache_lookups_total", "Near-duplicate prompt cache lookups by result (exact, near, miss, audited)", ["cache", "result"]
+)
+FILE_EXTRACTION_LATENCY = Histogram(
+    "file_extraction_duration_seconds", "Text extraction time per file kind", ["kind"]
+)
+FILE_EXTRACTION_BYTES = Counter(
+    "file_extraction_bytes_total", "Bytes of file content run through text extraction", ["kind"]
+)
+FILE_EXTRACTION_CACHE = Counter(
+    "file_extraction_cache_total", "Extraction cache lookups by result", ["result"]
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay between when the loop monitor was due to wake and when it ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Use the route template, not the raw path, to keep label cardinality bounded
+            route = scope.get("route")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"]
+            )
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """Record how late the event loop wakes up; sustained lag means blocking work on the loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - start - interval, 0))
@@ -0,0 +1,414 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, List, Optional
+
+from backend.conversation_context import estimate_tokens
+from backend.metrics import MODEL_CALL_COALESCED, MODEL_CALL_HEDGES, MODEL_CALL_LATENCY, MODEL_CALL_RETRIES
+from backend.rate_limiter import AdaptiveRateLimiter
+from backend.resilience import CircuitBreaker, CircuitOpenError, LatencyWindow
+from backend.response_cache import ResponseCache, prompt_key
+from backend.single_flight import SingleFlight
+from backend.startup import optional_import
+
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+IMAGE_PART_TOKENS = 1032  # Estimate for rate limiting: four 258-token tiles
+
+
+class ModelCallError(Exception):
+    """Raised when a model call still fails after all retries"""
+
+    def __init__(self, kind: str, original: Exception):
+        super().__init__(str(original))
+        self.kind = kind
+        self.original = original
+
+
+class QueueTimeoutError(asyncio.TimeoutError):
+    """Raised when a call's deadline passes before its request leaves the local queue"""
+
+
+def classify_error(error: Exception) -> str:
+    """Map an upstream exception onto the error categories the services handle"""
+    if isinstance(error, CircuitOpenError):
+        return "unavailable"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    error_msg = str(error).lower()
+    if "quota" in error_msg or "rate limit" in error_msg:
+        return "quota"
+    if "api key" in error_msg or "authentication" in error_msg:
+        return "auth"
+    if "network" in error_msg or "connection" in error_msg:
+        return "network"
+    if "content too large" in error_msg or "token limit" in error_msg:
+        return "too_large"
+    if "empty response" in error_msg or "block_reason" in error_msg or "safety_ratings" in error_msg or "response.text" in error_msg:
+        # Safety-blocked or empty answer to this particular prompt
+        return "blocked"
+    if error_msg.startswith(("500", "502", "503", "504")) or "internal error" in error_msg or "overloaded" in error_msg:
+        return "server"
+    return "other"
+
+
+def prompt_tokens(prompt: Any) -> int:
+    """Estimated input tokens of a text or multi-part prompt"""
+    if isinstance(prompt, str):
+        return estimate_tokens(prompt)
+    if isinstance(prompt, (list, tuple)):
+        return sum(prompt_tokens(part) for part in prompt)
+    if isinstance(prompt, dict) and "mime_type" in prompt:
+        # Gemini bills an image per 768px tile, 258 tokens each; images are downscaled to a few tiles at most
+        return IMAGE_PART_TOKENS
+    return 0
+
+
+class ModelClient:
+    """Shared async call layer for Gemini models.
+
+    Uses the SDK's async generation when the model provides it and a bounded
+    thread pool otherwise, caps the number of in-flight calls and backs off with
+    non-blocking sleeps so a slow or rate-limited call never stalls the event loop.
+    Every call, from any service, first passes the shared rate limiter, which
+    paces requests and tokens to the configured quota and slows down on 429s.
+    Identical prompts (text, or lists of text and image parts) that are in
+    flight at the same time share one call.
+
+    Each attempt has a timeout and each call an overall deadline. With
+    hedging on, an attempt still running after the call site's recent p95
+    latency gets a duplicate request and the first response wins; hedges
+    are limited to a fraction of calls. A circuit breaker rejects calls
+    while the upstream keeps failing, so services go straight to their
+    fallbacks.
+    """
+
+    # Errors that will not go away by retrying the same prompt
+    non_retryable = ("auth", "too_large", "unavailable", "blocked")
+    # Errors that indicate an unhealthy upstream rather than a bad request or quota; counted once per call
+    breaker_kinds = ("network", "timeout", "server")
+
+    def __init__(self, max_concurrency: Optional[int] = None, max_retries: int = 3, retry_delay: float = 1, cache=None,
+                 limiter: Optional[AdaptiveRateLimiter] = None, breaker: Optional[CircuitBreaker] = None):
+        self.max_concurrency = max_concurrency or int(os.getenv("GEMINI_MAX_CONCURRENCY", 8))
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay  # seconds
+        self.cache = cache if cache is not None else ResponseCache(int(os.getenv("RESPONSE_CACHE_SIZE", 1024)))
+        self.limiter = limiter if limiter is not None else AdaptiveRateLimiter(
+            rpm=float(os.getenv("GEMINI_RPM_LIMIT", 60)),
+            tpm=float(os.getenv("GEMINI_TPM_LIMIT", 1000000))
+        )
+        self.in_flight = SingleFlight()
+        self.attempt_timeout = float(os.getenv("GEMINI_CALL_TIMEOUT", 60))  # seconds per attempt; 0 disables
+        self.deadline = float(os.getenv("GEMINI_CALL_DEADLINE", 120))  # seconds per call, retries included; 0 disables
+        self.breaker = breaker if breaker is not None else CircuitBreaker(
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5)),
+            reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+        )
+        self.hedging = os.getenv("GEMINI_HEDGE", "0").lower() in ("1", "true", "yes")
+        self.hedge_quantile = float(os.getenv("GEMINI_HEDGE_QUANTILE", 0.95))
+        self.hedge_min_delay = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", 0.5))
+        self.hedge_max_ratio = float(os.getenv("GEMINI_HEDGE_MAX_RATIO", 0.1))
+        self.hedge_tokens = 0.0  # Each call earns hedge_max_ratio of a hedge; a hedge spends one
+        self.latencies = LatencyWindow()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="gemini")
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def generate(self, model: Any, prompt: Any, cache_ttl: Optional[float] = None, use_cache: bool = True,
+                       call_site: str = "unknown") -> str:
+        """Generate a response and return its text, retrying transient failures.
+
+        Call sites with deterministic prompts pass a cache_ttl (seconds) to serve
+        repeats from the shared response cache; use_cache=False bypasses it.
+        call_site labels the call in metrics.
+        """
+        start = time.perf_counter()
+        key = prompt_key(model, prompt) if isinstance(prompt, (str, list)) else None
+        if key is not None and cache_ttl and use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                MODEL_CALL_LATENCY.observe(time.perf_counter() - start, call_site=call_site, outcome="cache_hit")
+                return cached
+
+        shared = False
+        try:
+            if key is None:
+                text = await self._generate(model, prompt, call_site)
+            else:
+                # Concurrent identical prompts wait on the first caller's request
+                text, shared = await self.in_flight.do(key, lambda: self._generate(model, prompt, call_site))
+                if shared:
+                    MODEL_CALL_COALESCED.inc(call_site=call_site)
+        except ModelCallError as e:
+            MODEL_CALL_LATENCY.observe(time.perf_counter() - start, call_site=call_site, outcome=e.kind)
+            raise
+        MODEL_CALL_LATENCY.observe(time.perf_counter() - start, call_site=call_site, outcome="coalesced" if shared else "ok")
+        if key is not None and cache_ttl and not shared:
+            self.cache.set(key, text, cache_ttl)
+        return text
+
+    async def _generate(self, model: Any, prompt: Any, call_site: str) -> str:
+        deadline = time.monotonic() + self.deadline if self.deadline else None
+        unhealthy = False
+        for attempt in range(self.max_retries):
+            try:
+                if not self.breaker.allow():
+                    raise CircuitOpenError("Gemini is failing; calls are paused until it recovers")
+                response = await self._hedged_call(model, prompt, call_site, deadline)
+
+                # Check if response is valid
+                if not response or not response.text:
+                    raise ValueError("Empty response from Gemini API")
+
+                self.breaker.on_success()
+                self.limiter.on_success()
+                self.limiter.charge_tokens(estimate_tokens(response.text))
+                return response.text
+
+            except Exception as e:
+                kind = self._record_failure(e)
+                unhealthy = unhealthy or self._upstream_failure(e, kind)
+                remaining = deadline - time.monotonic() if deadline else None
+                if kind in self.non_retryable or attempt >= self.max_retries - 1 or (remaining is not None and remaining <= 0):
+                    if unhealthy:
+                        self.breaker.on_failure()
+                    raise ModelCallError(kind, e) from e
+                MODEL_CALL_RETRIES.inc(call_site=call_site, kind=kind)
+                delay = self._backoff(kind, attempt)
+                await asyncio.sleep(min(delay, remaining) if remaining is not None else delay)
+
+        raise ModelCallError("other", RuntimeError("No attempts were made"))
+
+    def _attempt_timeout(self, deadline: Optional[float]) -> Optional[float]:
+        """Seconds a request sent now may take: the attempt timeout, cut short by the call's deadline"""
+        timeout = self.attempt_timeout or None
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.0)
+            timeout = min(timeout, remaining) if timeout is not None else remaining
+        return timeout
+
+    def hedge_delay(self, call_site: str) -> Optional[float]:
+        """Seconds after which an attempt gets a hedge, or None when it should not be hedged"""
+        if not self.hedging or self.limiter.fraction < 1:
+            # Duplicates would only add to the load of a throttled upstream
+            return None
+        delay = self.latencies.quantile(call_site, self.hedge_quantile)
+        return max(delay, self.hedge_min_delay) if delay is not None else None
+
+    async def _hedged_call(self, model: Any, prompt: Any, call_site: str, deadline: Optional[float]) -> Any:
+        """One attempt, duplicated once if it is slower than usual; the first successful response wins"""
+        self.hedge_tokens = min(self.hedge_tokens + self.hedge_max_ratio, 10.0)  # Caps the burst of hedges after a quiet spell
+        delay = self.hedge_delay(call_site)
+        sent = asyncio.Event()
+        tasks: List[asyncio.Task] = [asyncio.ensure_future(self._call(model, prompt, call_site, deadline, sent))]
+        waiters: List[asyncio.Task] = []
+        try:
+            if delay is not None:
+                # The delay runs from when the request leaves the local queue, like the latencies it comes from
+                waiters.append(asyncio.ensure_future(sent.wait()))
+                await asyncio.wait([tasks[0], waiters[0]], return_when=asyncio.FIRST_COMPLETED)
+                if not tasks[0].done():
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    if not done and self.hedge_tokens >= 1:
+                        self.hedge_tokens -= 1
+                        MODEL_CALL_HEDGES.inc(call_site=call_site, result="sent")
+                        tasks.append(asyncio.ensure_future(self._call(model, prompt, call_site, deadline)))
+            error = None
+            pending = list(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1 and task is tasks[1]:
+                            MODEL_CALL_HEDGES.inc(call_site=call_site, result="won")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks + waiters:
+                task.cancel()
+
+    async def stream(self, model: Any, prompt: Any, call_site: str = "unknown") -> AsyncIterator[str]:
+        """Stream response text chunks as they are generated.
+
+        Failures before the first chunk are retried like generate(); once text
+        has been handed to the caller the error is raised instead.
+        """
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            async for text in self._stream(model, prompt, call_site):
+                yield text
+        except ModelCallError as e:
+            outcome = e.kind
+            raise
+        finally:
+            MODEL_CALL_LATENCY.observe(time.perf_counter() - start, call_site=call_site, outcome=outcome)
+
+    async def _stream(self, model: Any, prompt: Any, call_site: str) -> AsyncIterator[str]:
+        unhealthy = False
+        for attempt in range(self.max_retries):
+            started = False
+            generated = 0
+            try:
+                if not self.breaker.allow():
+                    raise CircuitOpenError("Gemini is failing; calls are paused until it recovers")
+                async for text in self._stream_call(model, prompt):
+                    if text:
+                        started = True
+                        generated += len(text)
+                        yield text
+                if not started:
+                    raise ValueError("Empty response from Gemini API")
+                self.breaker.on_success()
+                self.limiter.on_success()
+                self.limiter.charge_tokens(generated // 4 + 1)
+                return
+
+            except Exception as e:
+                kind = self._record_failure(e)
+                unhealthy = unhealthy or self._upstream_failure(e, kind)
+                if started or kind in self.non_retryable or attempt >= self.max_retries - 1:
+                    if unhealthy:
+                        self.breaker.on_failure()
+                    raise ModelCallError(kind, e) from e
+                MODEL_CALL_RETRIES.inc(call_site=call_site, kind=kind)
+                await asyncio.sleep(self._backoff(kind, attempt))
+
+    def _record_failure(self, error: Exception) -> str:
+        kind = classify_error(error)
+        if kind == "quota":
+            self.limiter.on_throttle()
+        return kind
+
+    def _upstream_failure(self, error: Exception, kind: str) -> bool:
+        """Whether a failed attempt says the upstream is unhealthy (and counts toward the circuit breaker)"""
+        # Waiting behind the local rate limit says nothing about the upstream's health
+        return kind in self.breaker_kinds and not isinstance(error, QueueTimeoutError)
+
+    def _backoff(self, kind: str, attempt: int) -> float:
+        """Delay before the next attempt.
+
+        Quota errors are paced by the rate limiter, which has just cut its
+        rate, so they go straight back into its queue.
+        """
+        if kind == "quota":
+            return 0
+        return self.retry_delay
+
+    async def _acquire(self, prompt: Any, deadline: Optional[float] = None):
+        """Wait for the rate limiter and a concurrency slot, for at most the time left until the deadline"""
+        async def queue():
+            await self.limiter.acquire(prompt_tokens(prompt))
+            await self._semaphore.acquire()
+
+        remaining = max(deadline - time.monotonic(), 0.0) if deadline is not None else None
+        try:
+            await asyncio.wait_for(queue(), remaining)
+        except asyncio.TimeoutError:
+            raise QueueTimeoutError("Deadline passed while waiting for the Gemini rate limit") from None
+
+    async def _call(self, model: Any, prompt: Any, call_site: str, deadline: Optional[float] = None,
+                    sent: Optional[asyncio.Event] = None) -> Any:
+        """Run a single generate_content call without blocking the event loop.
+
+        The attempt timeout and the latency sample start once the request
+        leaves the local queue, so time spent behind the rate limiter or the
+        concurrency limit is never taken for a slow upstream.
+        """
+        await self._acquire(prompt, deadline)
+        try:
+            if sent is not None:
+                sent.set()
+            start = time.monotonic()
+            generate_async = getattr(model, "generate_content_async", None)
+            if generate_async is not None:
+                request = generate_async(prompt)
+            else:
+                loop = asyncio.get_running_loop()
+                request = loop.run_in_executor(self._executor, model.generate_content, prompt)
+            response = await asyncio.wait_for(request, self._attempt_timeout(deadline))
+            self.latencies.record(call_site, time.monotonic() - start)
+            return response
+        finally:
+            self._semaphore.release()
+
+    async def _stream_call(self, model: Any, prompt: Any) -> AsyncIterator[str]:
+        """Run a single streaming generate_content call without blocking the event loop.
+
+        The attempt timeout bounds the wait for each chunk once the request
+        has left the local queue, so a stalled stream fails instead of hanging.
+        """
+        await self._acquire(prompt)
+        try:
+            timeout = self.attempt_timeout or None
+            generate_async = getattr(model, "generate_content_async", None)
+            if generate_async is not None:
+                response = await asyncio.wait_for(generate_async(prompt, stream=True), timeout)
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        return
+                    yield chunk.text
+
+            # Sync-only model: iterate the blocking stream in the thread pool
+            loop = asyncio.get_running_loop()
+            queue: asyncio.Queue = asyncio.Queue()
+            done = object()
+
+            def produce():
+                try:
+                    for chunk in model.generate_content(prompt, stream=True):
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+                    loop.call_soon_threadsafe(queue.put_nowait, done)
+                except Exception as e:
+                    loop.call_soon_threadsafe(queue.put_nowait, e)
+
+            producer = loop.run_in_executor(self._executor, produce)
+            while True:
+                item = await asyncio.wait_for(queue.get(), timeout)
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+            await producer
+        finally:
+            self._semaphore.release()
+
+
+_model_client: Optional[ModelClient] = None
+_gemini_model: Any = None
+_gemini_configured = False
+
+
+def get_model_client() -> ModelClient:
+    """Process-wide model client shared by all services"""
+    global _model_client
+    if _model_client is None:
+        _model_client = ModelClient()
+    return _model_client
+
+
+def get_gemini_model() -> Any:
+    """Process-wide Gemini model, or None when the SDK or API key is missing.
+
+    genai.configure() sets global SDK state, so it is done once here rather
+    than by every service.
+    """
+    global _gemini_model, _gemini_configured
+    if not _gemini_configured:
+        _gemini_configured = True
+        api_key = os.getenv("GEMINI_API_KEY")
+        # The SDK is slow to import, so it is only loaded when a key is configured
+        genai = optional_import("google.generativeai") if api_key else None
+        if genai and api_key:
+            try:
+                genai.configure(api_key=api_key)
+                _gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+            except Exception:
+                # If model initialization fails, keep graceful fallback
+                _gemini_model = None
+    return _gemini_model
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from typing import Dict
+
+
+class AdaptiveRateLimiter:
+    """Token buckets for requests-per-minute and tokens-per-minute with AIMD.
+
+    Callers are admitted strictly in arrival order (asyncio.Lock is FIFO).
+    Each quota/429 signal halves the admitted rate and empties the request
+    bucket; each success adds back a small fraction, so throughput settles
+    just under the upstream quota instead of oscillating through retry storms.
+    A limit of 0 disables that dimension.
+    """
+
+    def __init__(self, rpm: float, tpm: float, burst_seconds: float = 5, min_fraction: float = 0.05,
+                 increase: float = 0.02, decrease: float = 0.5, cooldown: float = 1.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst_seconds = burst_seconds
+        self.min_fraction = min_fraction
+        self.increase = increase  # Fraction of the limit added back per success
+        self.decrease = decrease  # Multiplier applied on a quota signal
+        self.cooldown = cooldown  # Concurrent 429s within this window count once
+        self.fraction = 1.0
+        self.waiting = 0
+        self.throttles = 0
+        self._requests = self._capacity(rpm)
+        self._tokens = self._capacity(tpm)
+        self._updated = time.monotonic()
+        self._last_throttle = 0.0
+        self._lock = asyncio.Lock()
+
+    def _capacity(self, per_minute: float) -> float:
+        return max(per_minute / 60 * self.burst_seconds, 1.0) if per_minute else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self._capacity(self.rpm), self._requests + elapsed * self.rpm * self.fraction / 60)
+        if self.tpm:
+            self._tokens = min(self._capacity(self.tpm), self._tokens + elapsed * self.tpm * self.fraction / 60)
+
+    async def acquire(self, tokens: int = 0):
+        """Wait for a request slot and the estimated tokens, in FIFO order"""
+        if not self.rpm and not self.tpm:
+            return
+        self.waiting += 1
+        try:
+            async with self._lock:
+                # A single prompt larger than the burst can still go once the bucket is full
+                tokens = min(tokens, self._capacity(self.tpm)) if self.tpm else 0
+                while True:
+                    self._refill()
+                    wait = 0.0
+                    if self.rpm and self._requests < 1:
+                        wait = max(wait, (1 - self._requests) * 60 / (self.rpm * self.fraction))
+                    if self.tpm and self._tokens < tokens:
+                        wait = max(wait, (tokens - self._tokens) * 60 / (self.tpm * self.fraction))
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                if self.rpm:
+                    self._requests -= 1
+                if self.tpm:
+                    self._tokens -= tokens
+        finally:
+            self.waiting -= 1
+
+    def charge_tokens(self, tokens: int):
+        """Account for tokens only known after the call (e.g. the response)"""
+        if self.tpm:
+            self._refill()
+            self._tokens -= tokens
+
+    def on_success(self):
+        self.fraction = min(1.0, self.fraction + self.increase)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_throttle < self.cooldown:
+            return
+        self._last_throttle = now
+        self.throttles += 1
+        self.fraction = max(self.min_fraction, self.fraction * self.decrease)
+        self._refill()
+        self._requests = min(self._requests, 0.0)
+
+    def stats(self) -> Dict:
+        return {
+            "fraction": self.fraction,
+            "effective_rpm": self.rpm * self.fraction,
+            "effective_tpm": self.tpm * self.fraction,
+            "waiting": self.waiting,
+            "throttles": self.throttles
+        }
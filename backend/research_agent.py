@@ -1,130 +1,163 @@
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None
-try:
-    import requests
-except Exception:
-    requests = None
 import os
-import time
-from typing import List, Dict, Optional
-try:
-    from bs4 import BeautifulSoup
-except Exception:
-    BeautifulSoup = None
+import asyncio
+import hashlib
+from typing import List, Dict, Optional, Tuple
 import json
-from dotenv import load_dotenv
 
-load_dotenv()
+from backend.metrics import RESEARCH_STAGE_LATENCY
+from backend.model_client import ModelCallError, get_gemini_model, get_model_client
+from backend.response_cache import ResponseCache
+from backend.retrieval import normalize_text
+from backend.similarity_cache import create_similarity_cache
+from backend.web_search import PageFetcher, SearchProvider, create_search_provider
+
 
 class ResearchAgent:
     def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        self.model = None
-        if genai and api_key:
-            try:
-                genai.configure(api_key=api_key)
-                self.model = genai.GenerativeModel('gemini-2.5-flash')
-            except Exception:
-                self.model = None
-        self.max_retries = 3
-        self.retry_delay = 1  # seconds
+        self.model = get_gemini_model()
+        self.client = get_model_client()
+        # Cache TTLs per research stage, in seconds
+        self.search_terms_cache_ttl = 3600
+        self.search_results_cache_ttl = 600
+        self.analysis_cache_ttl = 900
+        self.fallback_cache_ttl = 600
+        # Stage caches: normalized query -> search terms, search term -> results, result set -> analysis
+        self.search_terms_cache = ResponseCache(int(os.getenv("RESEARCH_TERMS_CACHE_SIZE", 1024)))
+        self.search_results_cache = ResponseCache(int(os.getenv("RESEARCH_RESULTS_CACHE_SIZE", 2048)))
+        self.analysis_cache = ResponseCache(int(os.getenv("RESEARCH_ANALYSIS_CACHE_SIZE", 512)))
+        # Opt-in cache of whole answers shared by near-duplicate queries (see SIMILARITY_CACHE)
+        self.similarity_cache = create_similarity_cache("research")
+        self.search_provider: SearchProvider = create_search_provider()
+        self.page_fetcher = PageFetcher()
+        self._search_semaphore = asyncio.Semaphore(int(os.getenv("SEARCH_CONCURRENCY", 3)))
         
-    async def research_and_respond(self, query: str) -> str:
-        """Perform deep research and provide comprehensive response"""
+    async def research_and_respond(self, query: str, use_cache: bool = True, raise_errors: bool = False) -> str:
+        """Perform deep research and provide comprehensive response.
+
+        Search terms, search results and result analysis are cached per stage,
+        so repeated or overlapping queries skip those round-trips; pass
+        use_cache=False to force fresh research. With raise_errors, a failed
+        final answer raises ModelCallError instead of returning fallback text.
+        """
         if not self.model:
+            if raise_errors:
+                raise ModelCallError("auth", RuntimeError("Research service is not configured. Please set GEMINI_API_KEY."))
             return "Research service is not configured. Please set GEMINI_API_KEY."
+        if use_cache and self.similarity_cache is not None:
+            cached = self.similarity_cache.get(query)
+            if cached is not None:
+                return cached
         try:
             # Step 1: Analyze the query and generate search terms
-            search_terms = await self._generate_search_terms(query)
+            with RESEARCH_STAGE_LATENCY.time(stage="search_terms"):
+                search_terms = await self._generate_search_terms(query, use_cache)
             
-            # Step 2: Perform web searches
-            search_results = []
-            for term in search_terms[:3]:  # Limit to 3 searches
-                results = await self._web_search(term)
-                search_results.extend(results)
+            # Step 2: Perform web searches concurrently
+            with RESEARCH_STAGE_LATENCY.time(stage="search"):
+                result_lists = await asyncio.gather(*(self._web_search(term, use_cache) for term in search_terms[:3]))  # Limit to 3 searches
+            search_results = self._dedupe_results([result for results in result_lists for result in results])
             
-            # Step 3: Extract and analyze content from top results
-            analyzed_content = await self._analyze_search_results(search_results[:5])
+            # Step 3: Fetch, extract and analyze content from top results
+            top_results = search_results[:5]
+            analysis_key = self._result_set_key(top_results)
+            analyzed_content = self.analysis_cache.get(analysis_key) if use_cache else None
+            if analyzed_content is None:
+                if self.search_provider.fetch_pages:
+                    with RESEARCH_STAGE_LATENCY.time(stage="fetch"):
+                        top_results = await self.page_fetcher.enrich(top_results)
+                with RESEARCH_STAGE_LATENCY.time(stage="analysis"):
+                    analyzed_content = await self._analyze_search_results(top_results, analysis_key)
             
             # Step 4: Generate comprehensive response
-            response = await self._generate_research_response(query, analyzed_content)
+            with RESEARCH_STAGE_LATENCY.time(stage="response"):
+                response, generated = await self._generate_research_response(query, analyzed_content, raise_errors)
             
+            # Fallback text is not worth serving to the next near-duplicate query
+            if generated and self.similarity_cache is not None:
+                self.similarity_cache.set(query, response)
             return response
             
         except Exception as e:
-            return f"I apologize, but I encountered an error during research: {str(e)}. I'll provide a response based on my training data instead.\n\n" + await self._fallback_response(query)
+            if raise_errors and isinstance(e, ModelCallError):
+                raise
+            return f"I apologize, but I encountered an error during research: {str(e)}. I'll provide a response based on my training data instead.\n\n" + await self._fallback_response(query, use_cache)
     
-    async def _generate_search_terms(self, query: str) -> List[str]:
+    async def _generate_search_terms(self, query: str, use_cache: bool = True) -> List[str]:
         """Generate relevant search terms for the query with error handling"""
-        for attempt in range(self.max_retries):
-            try:
-                prompt = f"""You are a research assistant. Generate 2-3 specific search terms that would help find the most relevant and current information for the user's query. Return only the search terms, one per line.
+        cache_key = normalize_text(query)
+        if use_cache:
+            cached = self.search_terms_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
+
+        prompt = f"""You are a research assistant. Generate 2-3 specific search terms that would help find the most relevant and current information for the user's query. Return only the search terms, one per line.
 
 Query: {query}"""
-                
-                response = self.model.generate_content(prompt)
-                
-                # Check if response is valid
-                if not response or not response.text:
-                    raise ValueError("Empty response from Gemini API")
-                
-                # Parse search terms from response
-                terms = [term.strip() for term in response.text.strip().split('\n') if term.strip()]
-                return terms[:3] if terms else [query]  # Fallback to original query
-                
-            except Exception as e:
-                error_msg = str(e).lower()
-                
-                if "quota" in error_msg or "rate limit" in error_msg:
-                    if attempt < self.max_retries - 1:
-                        wait_time = self.retry_delay * (2 ** attempt)
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        # Fallback to using the original query
-                        return [query]
-                
-                elif attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
-                    continue
-                else:
-                    # Fallback to using the original query
-                    return [query]
-        
-        return [query]
+
+        try:
+            text = await self.client.generate(self.model, prompt, call_site="research_search_terms")
+        except ModelCallError:
+            # Fallback to using the original query
+            return [query]
+
+        # Parse search terms from response
+        terms = [term.strip() for term in text.strip().split('\n') if term.strip()]
+        terms = terms[:3] if terms else [query]  # Fallback to original query
+        self.search_terms_cache.set(cache_key, terms, self.search_terms_cache_ttl)
+        return list(terms)
     
-    async def _web_search(self, query: str) -> List[Dict]:
-        """Perform web search using simulated results"""
-        # This is a simplified simulation placeholder for web search
+    async def _web_search(self, query: str, use_cache: bool = True) -> List[Dict]:
+        """Perform web search through the configured provider"""
+        cache_key = f"{self.search_provider.name}:{normalize_text(query)}"
+        if use_cache:
+            cached = self.search_results_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
         try:
-            # Simulated search results for demo purposes
-            return [
-                {
-                    "title": f"Search result for: {query}",
-                    "link": "https://example.com",
-                    "snippet": f"This is a simulated search result for the query: {query}. In a real implementation, this would contain actual web search results from a search API."
-                }
-            ]
-        except Exception as e:
+            async with self._search_semaphore:
+                results = await self.search_provider.search(query)
+        except Exception:
             return []
+        self.search_results_cache.set(cache_key, results, self.search_results_cache_ttl)
+        return list(results)
+    
+    def _result_set_key(self, results: List[Dict]) -> str:
+        """Hash identifying a set of search results"""
+        return hashlib.sha256(json.dumps(results, sort_keys=True).encode("utf-8")).hexdigest()
     
-    async def _analyze_search_results(self, results: List[Dict]) -> str:
+    def _dedupe_results(self, results: List[Dict]) -> List[Dict]:
+        """Drop results that already appeared for another search term"""
+        seen = set()
+        unique = []
+        for result in results:
+            key = (result.get("link"), result.get("title"))
+            if key in seen:
+                continue
+            seen.add(key)
+            unique.append(result)
+        return unique
+    
+    async def aclose(self):
+        """Close pooled HTTP clients"""
+        await self.search_provider.aclose()
+        await self.page_fetcher.aclose()
+    
+    async def _analyze_search_results(self, results: List[Dict], cache_key: Optional[str] = None) -> str:
         """Analyze search results and extract key information with error handling"""
         if not results:
             return "No search results available for analysis."
         
-        for attempt in range(self.max_retries):
-            try:
-                # Prepare content for analysis
-                content = "Search Results Analysis:\n\n"
-                for i, result in enumerate(results, 1):
-                    content += f"{i}. Title: {result.get('title', 'N/A')}\n"
-                    content += f"   Link: {result.get('link', 'N/A')}\n"
-                    content += f"   Summary: {result.get('snippet', 'N/A')}\n\n"
-                
-                prompt = f"""Please analyze the following search results and extract the most important and relevant information. Summarize the key points, facts, and insights that would be useful for answering user queries.
+        # Prepare content for analysis
+        content = "Search Results Analysis:\n\n"
+        for i, result in enumerate(results, 1):
+            content += f"{i}. Title: {result.get('title', 'N/A')}\n"
+            content += f"   Link: {result.get('link', 'N/A')}\n"
+            content += f"   Summary: {result.get('snippet', 'N/A')}\n"
+            if result.get('content'):
+                content += f"   Page content: {result['content']}\n"
+            content += "\n"
+
+        prompt = f"""Please analyze the following search results and extract the most important and relevant information. Summarize the key points, facts, and insights that would be useful for answering user queries.
 
 {content}
 
@@ -132,34 +165,16 @@ Please provide a concise analysis focusing on:
 1. Key facts and information
 2. Important insights or trends
 3. Relevant details that answer common questions about this topic"""
-                
-                response = self.model.generate_content(prompt)
-                
-                # Check if response is valid
-                if not response or not response.text:
-                    raise ValueError("Empty response from Gemini API")
-                
-                return response.text
-                
-            except Exception as e:
-                error_msg = str(e).lower()
-                
-                if "quota" in error_msg or "rate limit" in error_msg:
-                    if attempt < self.max_retries - 1:
-                        wait_time = self.retry_delay * (2 ** attempt)
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        # Fallback to basic summary
-                        return self._create_basic_summary(results)
-                
-                elif attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
-                    continue
-                else:
-                    return self._create_basic_summary(results)
-        
-        return self._create_basic_summary(results)
+
+        try:
+            analysis = await self.client.generate(self.model, prompt, call_site="research_analysis")
+        except ModelCallError:
+            # Fallback to basic summary
+            return self._create_basic_summary(results)
+
+        if cache_key:
+            self.analysis_cache.set(cache_key, analysis, self.analysis_cache_ttl)
+        return analysis
     
     def _create_basic_summary(self, results: List[Dict]) -> str:
         """Create a basic summary when AI analysis fails"""
@@ -169,11 +184,12 @@ Please provide a concise analysis focusing on:
             summary += f"   {result.get('snippet', 'No description available')}\n\n"
         return summary
     
-    async def _generate_research_response(self, original_query: str, research_content: str) -> str:
-        """Generate comprehensive response based on research with error handling"""
-        for attempt in range(self.max_retries):
-            try:
-                prompt = f"""Based on the research content provided below, please generate a comprehensive and well-structured response to the user's original query. The response should be informative, accurate, and directly address the user's question.
+    async def _generate_research_response(self, original_query: str, research_content: str, raise_errors: bool = False) -> Tuple[str, bool]:
+        """Generate comprehensive response based on research with error handling.
+
+        Returns the response and whether it came from the model rather than the fallback.
+        """
+        prompt = f"""Based on the research content provided below, please generate a comprehensive and well-structured response to the user's original query. The response should be informative, accurate, and directly address the user's question.
 
 Original Query: {original_query}
 
@@ -188,68 +204,26 @@ Please provide a detailed response that:
 5. Mentions if the information is based on recent research findings
 
 Response:"""
-                
-                response = self.model.generate_content(prompt)
-                
-                # Check if response is valid
-                if not response or not response.text:
-                    raise ValueError("Empty response from Gemini API")
-                
-                return response.text
-                
-            except Exception as e:
-                error_msg = str(e).lower()
-                
-                if "quota" in error_msg or "rate limit" in error_msg:
-                    if attempt < self.max_retries - 1:
-                        wait_time = self.retry_delay * (2 ** attempt)
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        # Fallback to basic response
-                        return f"Based on the research findings:\n\n{research_content}\n\nThis information addresses your query about: {original_query}"
-                
-                elif attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
-                    continue
-                else:
-                    return f"Based on the research findings:\n\n{research_content}\n\nThis information addresses your query about: {original_query}"
-        
-        return f"Based on the research findings:\n\n{research_content}\n\nThis information addresses your query about: {original_query}"
+
+        try:
+            return await self.client.generate(self.model, prompt, call_site="research_response"), True
+        except ModelCallError:
+            if raise_errors:
+                raise
+            # Fallback to basic response
+            return f"Based on the research findings:\n\n{research_content}\n\nThis information addresses your query about: {original_query}", False
     
-    async def _fallback_response(self, query: str) -> str:
+    async def _fallback_response(self, query: str, use_cache: bool = True) -> str:
         """Provide fallback response when research fails with error handling"""
-        for attempt in range(self.max_retries):
-            try:
-                prompt = f"""Please provide a helpful and informative response to the following query based on your training data. Be clear that this response is based on your general knowledge and not current web research.
+        prompt = f"""Please provide a helpful and informative response to the following query based on your training data. Be clear that this response is based on your general knowledge and not current web research.
 
 Query: {query}
 
 Please provide a comprehensive answer while noting that this information is based on your training data and may not reflect the most recent developments."""
-                
-                response = self.model.generate_content(prompt)
-                
-                # Check if response is valid
-                if not response or not response.text:
-                    raise ValueError("Empty response from Gemini API")
-                
-                return response.text
-                
-            except Exception as e:
-                error_msg = str(e).lower()
-                
-                if "quota" in error_msg or "rate limit" in error_msg:
-                    if attempt < self.max_retries - 1:
-                        wait_time = self.retry_delay * (2 ** attempt)
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        return f"I understand you're asking about: {query}\n\nI'm currently unable to provide a detailed response due to high demand. Please try again in a few moments, or rephrase your question for better results."
-                
-                elif attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
-                    continue
-                else:
-                    return f"I understand you're asking about: {query}\n\nI'm currently experiencing technical difficulties. Please try again later or contact support if the issue persists."
-        
-        return f"I understand you're asking about: {query}\n\nI'm currently experiencing technical difficulties. Please try again later or contact support if the issue persists."
\ No newline at end of file
+
+        try:
+            return await self.client.generate(self.model, prompt, cache_ttl=self.fallback_cache_ttl, use_cache=use_cache, call_site="research_fallback")
+        except ModelCallError as e:
+            if e.kind == "quota":
+                return f"I understand you're asking about: {query}\n\nI'm currently unable to provide a detailed response due to high demand. Please try again in a few moments, or rephrase your question for better results."
+            return f"I understand you're asking about: {query}\n\nI'm currently experiencing technical difficulties. Please try again later or contact support if the issue persists."
@@ -0,0 +1,98 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is failing"""
+
+
+class CircuitBreaker:
+    """Stops calling an unhealthy upstream so callers fail fast.
+
+    After failure_threshold consecutive failures the circuit opens and every
+    call is rejected for reset_timeout seconds. Then a single probe call is
+    let through (half-open): success closes the circuit, failure opens it
+    again. A threshold of 0 disables the breaker.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout  # seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now"""
+        if not self.failure_threshold or self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_started = 0.0
+        # One probe at a time; a probe that never reported back (cancelled) is replaced after reset_timeout
+        if self.state == self.HALF_OPEN and now - self._probe_started >= self.reset_timeout:
+            self._probe_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def on_success(self):
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+
+    def on_failure(self):
+        self.consecutive_failures += 1
+        if not self.failure_threshold:
+            return
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        return {
+            "open": 1 if self.state == self.OPEN else 0,
+            "half_open": 1 if self.state == self.HALF_OPEN else 0,
+            "consecutive_failures": self.consecutive_failures,
+            "opens": self.opens,
+            "rejected": self.rejected
+        }
+
+
+class LatencyWindow:
+    """Durations of the most recent successful calls, per key.
+
+    quantile() returns None until min_samples durations have been seen, so
+    decisions based on it (such as when to hedge) wait for real data.
+    """
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.size = size
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, seconds: float):
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.size)
+        samples.append(seconds)
+
+    def quantile(self, key: str, q: float) -> Optional[float]:
+        samples = self._samples.get(key)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def keys(self):
+        return list(self._samples)
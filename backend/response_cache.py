@@ -0,0 +1,72 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def prompt_key(model: Any, prompt: Any) -> str:
+    """Cache key for a text prompt, or a list of text and {"mime_type", "data"} parts, sent to a given model"""
+    model_name = getattr(model, "model_name", type(model).__name__)
+    if isinstance(prompt, str):
+        return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+    digest = hashlib.sha256(f"{model_name}\0".encode("utf-8"))
+    for part in prompt:
+        if isinstance(part, str):
+            digest.update(b"\0text\0" + part.encode("utf-8"))
+        else:
+            digest.update(b"\0" + part["mime_type"].encode("utf-8") + b"\0" + part["data"])
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of model responses with per-entry TTL.
+
+    Any object with the same get/set/stats methods can be plugged into
+    ModelClient in its place (e.g. a shared external cache). Values are not
+    restricted to strings, so it also backs the research stage caches.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        """Store a value for ttl seconds, evicting least recently used entries"""
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,134 @@
+import hashlib
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it of on or that the this to was what when "
+    "where which who why will with you your me my we our do does did can could should would".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace; used as a cache key for prompts and queries"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def _text_units(text: str, max_chars: int, overlap: int) -> Iterator[str]:
+    """Paragraphs, or lines of over-long paragraphs, or windows of over-long lines"""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= max_chars:
+            if paragraph:
+                yield paragraph
+            continue
+        for line in paragraph.split("\n"):
+            line = line.strip()
+            if len(line) <= max_chars:
+                if line:
+                    yield line
+                continue
+            step = max_chars - overlap
+            for start in range(0, len(line), step):
+                yield line[start:start + max_chars]
+                if start + max_chars >= len(line):
+                    break
+
+
+def chunk_text(text: str, chunk_chars: int = 1500, overlap: int = 200) -> List[str]:
+    """Split text into chunks of about chunk_chars, preferring paragraph and line boundaries"""
+    chunks = []
+    current: List[str] = []
+    length = 0
+    for unit in _text_units(text, chunk_chars, overlap):
+        if length + len(unit) > chunk_chars and current:
+            chunks.append("\n".join(current))
+            current, length = [], 0
+        current.append(unit)
+        length += len(unit) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 ranking over an inverted index of text chunks"""
+
+    def __init__(self, chunks: List[str], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}  # term -> [(chunk index, term frequency)]
+        self.lengths: List[int] = []
+        for index, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            self.lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((index, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, int]]:
+        """Return the k best (score, chunk index) pairs for the query"""
+        scores: Dict[int, float] = {}
+        chunk_count = len(self.chunks)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / (self.average_length or 1))
+                scores[index] = scores.get(index, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(((score, index) for index, score in scores.items()), reverse=True)[:k]
+
+    def top_chunks(self, query: str, k: int = 5) -> List[str]:
+        """The k most relevant chunks, in document order"""
+        hits = self.search(query, k)
+        if not hits:
+            # Nothing matched; the opening of the document is the best guess
+            return self.chunks[:k]
+        return [self.chunks[index] for index in sorted(index for _, index in hits)]
+
+
+class RetrievalIndexCache:
+    """Least recently used cache of built indexes, so each document is chunked once"""
+
+    def __init__(self, max_indexes: int = 32, chunk_chars: int = 1500):
+        self.max_indexes = max_indexes
+        self.chunk_chars = chunk_chars
+        self._indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()  # Indexes are built in worker threads
+
+    def get(self, text: str, key: Optional[str] = None) -> BM25Index:
+        """Return the index for text, building it on first use"""
+        key = key or hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+
+        index = BM25Index(chunk_text(text, self.chunk_chars))
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def discard(self, key_prefix: str):
+        with self._lock:
+            for key in [key for key in self._indexes if key.startswith(key_prefix)]:
+                del self._indexes[key]
+
+
+def format_excerpts(chunks: List[str]) -> str:
+    """Join retrieved chunks into a prompt section"""
+    return "\n\n".join(f"[Excerpt {i}]\n{chunk}" for i, chunk in enumerate(chunks, 1))
@@ -0,0 +1,55 @@
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from backend import startup
+
+# The single place .env is read; services import their settings from os.environ
+load_dotenv()
+
+_instances: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def _get(name: str, factory: Callable[[], Any]) -> Any:
+    """Build a service on first use; its module and dependencies are imported then too"""
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                modules_before = len(sys.modules)
+                start = time.perf_counter()
+                instance = factory()
+                startup.record_service(name, time.perf_counter() - start, len(sys.modules) - modules_before)
+                _instances[name] = instance
+    return instance
+
+
+def loaded(name: str) -> Optional[Any]:
+    """The service if it has been built, without building it"""
+    return _instances.get(name)
+
+
+def get_chat_service():
+    def build():
+        from backend.chat_service import ChatService
+        return ChatService()
+    return _get("chat", build)
+
+
+def get_file_service():
+    def build():
+        from backend.file_service import FileService
+        return FileService()
+    return _get("files", build)
+
+
+def get_research_agent():
+    def build():
+        from backend.research_agent import ResearchAgent
+        return ResearchAgent()
+    return _get("research", build)
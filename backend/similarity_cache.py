@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from backend.metrics import SIMILARITY_CACHE_LOOKUPS
+from backend.retrieval import normalize_text
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def shingles(normalized: str) -> FrozenSet[str]:
+    """Words plus unordered pairs of adjacent words.
+
+    Reordering clauses keeps most of the set, while swapping the roles of two
+    words ("is X faster than Y") still changes the pairs around them.
+    """
+    words = normalized.split()
+    pairs = (" ".join(sorted(pair)) for pair in zip(words, words[1:]))
+    return frozenset(words).union(pairs)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("prompt", "shingles", "bands", "value", "expires_at")
+
+    def __init__(self, prompt: str, shingle_set: FrozenSet[str], bands: List[Tuple[int, int]], value: Any, expires_at: float):
+        self.prompt = prompt
+        self.shingles = shingle_set
+        self.bands = bands
+        self.value = value
+        self.expires_at = expires_at
+
+
+class SimilarityCache:
+    """Near-duplicate prompt cache using MinHash signatures and LSH banding.
+
+    Prompts are normalized and reduced to shingles; each entry's MinHash
+    signature is split into bands, and a lookup only compares against entries
+    sharing at least one band. Candidates are confirmed with the exact
+    Jaccard similarity of their shingles, and the best one at or above
+    threshold is a hit.
+
+    Near (non-exact) hits are appended to audit_log as JSON lines with both
+    prompts and their similarity. A fraction audit_rate of them is not served
+    from the cache: the caller gets a miss, and the response it then stores is
+    compared with the cached one, with dissimilar pairs logged as suspected
+    false hits.
+    """
+
+    def __init__(self, name: str, threshold: float = 0.8, max_entries: int = 1024, ttl: float = 3600,
+                 num_perm: int = 64, bands: int = 16, max_chars: int = 2000,
+                 audit_log: Optional[str] = None, audit_rate: float = 0.0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.name = name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_chars = max_chars  # Longer prompts (pasted documents) are not cached
+        self.audit_log = audit_log
+        self.audit_rate = audit_rate
+        rng = random.Random(1)  # Fixed permutations, so signatures are comparable across processes
+        self._permutations = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()  # Normalized prompt -> entry, least recently used first
+        self._buckets: Dict[Tuple[int, int], set] = {}  # (band, band hash) -> normalized prompts
+        self._audits: Dict[str, Tuple[str, Any, float]] = {}  # Normalized prompt -> (matched prompt, cached value, similarity)
+        self._audit_lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.audited = 0
+        self.suspected_false_hits = 0
+
+    def _signature(self, shingle_set: FrozenSet[str]) -> List[int]:
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "big") for s in shingle_set]
+        return [
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) if hashes else 0
+            for a, b in self._permutations
+        ]
+
+    def _bands(self, signature: List[int]) -> List[Tuple[int, int]]:
+        return [
+            (band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows])))
+            for band in range(self.bands)
+        ]
+
+    def get(self, prompt: str) -> Optional[Any]:
+        """Cached value for this prompt or a near duplicate of it, or None"""
+        normalized = normalize_text(prompt)
+        if not normalized or len(normalized) > self.max_chars:
+            return None
+        now = time.monotonic()
+        entry = self._entries.get(normalized)
+        if entry is not None and entry.expires_at >= now:
+            self._entries.move_to_end(normalized)
+            self.exact_hits += 1
+            SIMILARITY_CACHE_LOOKUPS.inc(cache=self.name, result="exact")
+            return entry.value
+
+        shingle_set = shingles(normalized)
+        candidates = set()
+        for band in self._bands(self._signature(shingle_set)):
+            candidates.update(self._buckets.get(band, ()))
+        best, best_similarity = None, 0.0
+        for key in candidates:
+            candidate = self._entries[key]
+            if candidate.expires_at < now:
+                continue
+            similarity = jaccard(shingle_set, candidate.shingles)
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is None:
+            self.misses += 1
+            SIMILARITY_CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+            return None
+
+        if self.audit_rate and random.random() < self.audit_rate:
+            # Let the caller compute a fresh answer and compare it with the cached one in set()
+            self._audits[normalized] = (best.prompt, best.value, best_similarity)
+            while len(self._audits) > self.max_entries:
+                # Audited lookups whose fresh answer never arrived (the call failed)
+                del self._audits[next(iter(self._audits))]
+            self.audited += 1
+            SIMILARITY_CACHE_LOOKUPS.inc(cache=self.name, result="audited")
+            return None
+        self._entries.move_to_end(normalize_text(best.prompt))
+        self.near_hits += 1
+        SIMILARITY_CACHE_LOOKUPS.inc(cache=self.name, result="near")
+        self._log({"event": "near_hit", "similarity": round(best_similarity, 3), "prompt": prompt, "matched_prompt": best.prompt})
+        return best.value
+
+    def set(self, prompt: str, value: Any):
+        """Store the value for a prompt, evicting least recently used entries"""
+        normalized = normalize_text(prompt)
+        if not normalized or len(normalized) > self.max_chars:
+            return
+        audit = self._audits.pop(normalized, None)
+        if audit is not None:
+            self._check_audit(prompt, value, *audit)
+
+        self._remove(normalized)
+        shingle_set = shingles(normalized)
+        bands = self._bands(self._signature(shingle_set))
+        self._entries[normalized] = _Entry(prompt, shingle_set, bands, value, time.monotonic() + self.ttl)
+        for band in bands:
+            self._buckets.setdefault(band, set()).add(normalized)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, normalized: str):
+        entry = self._entries.pop(normalized, None)
+        if entry is None:
+            return
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(normalized)
+                if not bucket:
+                    del self._buckets[band]
+
+    def _check_audit(self, prompt: str, fresh: Any, matched_prompt: str, cached: Any, similarity: float):
+        """Compare the fresh answer for an audited near hit with the answer the cache would have served"""
+        agreement = jaccard(shingles(normalize_text(str(fresh))), shingles(normalize_text(str(cached))))
+        # Two answers to the same question rarely share under a quarter of their wording
+        suspected = agreement < 0.25
+        if suspected:
+            self.suspected_false_hits += 1
+        self._log({
+            "event": "audit", "similarity": round(similarity, 3), "response_agreement": round(agreement, 3),
+            "suspected_false_hit": suspected, "prompt": prompt, "matched_prompt": matched_prompt
+        })
+
+    def _log(self, record: Dict):
+        if not self.audit_log:
+            return
+        record = {"time": time.time(), "cache": self.name, "threshold": self.threshold, **record}
+        with self._audit_lock, open(self.audit_log, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def stats(self) -> Dict:
+        lookups = self.exact_hits + self.near_hits + self.misses + self.audited
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "audited": self.audited,
+            "suspected_false_hits": self.suspected_false_hits,
+            "hit_rate": (self.exact_hits + self.near_hits) / lookups if lookups else 0.0
+        }
+
+
+def create_similarity_cache(name: str) -> Optional[SimilarityCache]:
+    """The cache configured by SIMILARITY_CACHE_* settings, or None when it is disabled (the default)"""
+    if os.getenv("SIMILARITY_CACHE", "0").lower() not in ("1", "true", "yes"):
+        return None
+    return SimilarityCache(
+        name,
+        threshold=float(os.getenv("SIMILARITY_CACHE_THRESHOLD", 0.8)),
+        max_entries=int(os.getenv("SIMILARITY_CACHE_SIZE", 1024)),
+        ttl=float(os.getenv("SIMILARITY_CACHE_TTL", 3600)),
+        audit_log=os.getenv("SIMILARITY_CACHE_AUDIT_LOG") or None,
+        audit_rate=float(os.getenv("SIMILARITY_CACHE_AUDIT_RATE", 0.0))
+    )
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one underlying call.
+
+    Every caller awaits the same task and gets its result or its exception.
+    A caller being cancelled does not cancel the shared task while others are
+    still waiting on it; when the last waiter goes away the task is cancelled.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result, shared); shared is True when another caller started the call"""
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(factory()))
+            call.task.add_done_callback(lambda task: self._finished(key, call))
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is left to use the result
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _finished(self, key: str, call: _Call):
+        self._forget(key, call)
+        if not call.task.cancelled():
+            # Mark the exception as retrieved even if every waiter was cancelled
+            call.task.exception()
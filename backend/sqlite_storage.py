@@ -0,0 +1,589 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from backend.conversation_context import estimate_tokens
+from backend.conversation_store import Conversation, Message, make_snippet, make_title
+from backend.retrieval import tokenize
+from backend.storage import FileStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    update_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS conversations_update_seq ON conversations (update_seq);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS messages_position ON messages (conversation_id, position);
+CREATE TABLE IF NOT EXISTS conversation_terms (
+    term TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    PRIMARY KEY (term, conversation_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversation_terms_conversation ON conversation_terms (conversation_id);
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    filename TEXT,
+    content_type TEXT,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    refs INTEGER NOT NULL
+);
+"""
+
+CONVERSATION_COLUMNS = "id, title, created_at, updated_at, message_count, update_seq"
+
+
+class SQLiteDatabase:
+    """SQLite database in WAL mode shared by every worker process.
+
+    Readers use one connection per thread and never block the writer. Writes
+    are queued and committed in batches: flush() runs everything queued so
+    far in one transaction on a dedicated writer thread, and callers flushing
+    while a commit is in progress are served by the next batch (group commit).
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._pending: List[Tuple[str, Iterable, bool]] = []
+        self._queued_seq = 0
+        self.committed_seq = 0  # Every write queued with a sequence number up to this one is committed
+        self.commits = 0
+        self._flush_lock = asyncio.Lock()
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; write transactions are opened explicitly
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints; a crash cannot corrupt the database
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        return self.connection().execute(sql, tuple(params)).fetchall()
+
+    def query_one(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        return self.connection().execute(sql, tuple(params)).fetchone()
+
+    def queue(self, sql: str, params: Iterable = (), many: bool = False) -> int:
+        """Queue a write for the next commit; returns its sequence number"""
+        self._pending.append((sql, params, many))
+        self._queued_seq += 1
+        return self._queued_seq
+
+    @property
+    def pending(self) -> int:
+        return self._queued_seq - self.committed_seq
+
+    async def flush(self):
+        """Commit every write queued so far"""
+        target = self._queued_seq
+        if self.committed_seq >= target:
+            return
+        async with self._flush_lock:
+            if self.committed_seq >= target:
+                # Committed by the batch that was in progress while we waited
+                return
+            batch, self._pending = self._pending, []
+            last_seq = self._queued_seq
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._writer, self._commit, batch)
+            except Exception:
+                # Keep the writes so the next flush retries them
+                self._pending = batch + self._pending
+                raise
+            self.committed_seq = last_seq
+            self.commits += 1
+
+    def snapshot(self, func: Callable, *args) -> Any:
+        """Run func(connection, *args) in a read transaction, so its queries see one consistent state.
+
+        Blocking; call it through asyncio.to_thread.
+        """
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            return func(conn, *args)
+        finally:
+            conn.execute("COMMIT")
+
+    async def transaction(self, func: Callable, *args) -> Any:
+        """Run func(connection, *args) in a write transaction of its own on the writer thread.
+
+        For writes that cannot be queued as plain statements, such as
+        streaming a large value into a blob.
+        """
+        async with self._flush_lock:
+            return await asyncio.get_running_loop().run_in_executor(self._writer, self._transaction, func, args)
+
+    def _commit(self, batch: List[Tuple[str, Iterable, bool]]):
+        def run(conn: sqlite3.Connection):
+            for sql, params, many in batch:
+                if many:
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, tuple(params))
+        self._transaction(run, ())
+
+    def _transaction(self, func: Callable, args: tuple) -> Any:
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class SQLiteConversationStore:
+    """Conversation store persisted in SQLite, consistent across worker processes.
+
+    Recently used conversations are cached with their latest messages (about
+    window_tokens worth, what prompt context building needs), bounded by
+    max_conversations and max_bytes. Every get() checks the stored message
+    count, so messages added by another worker are loaded incrementally.
+    Reads run in worker threads, off the event loop. Listing and search run
+    as indexed queries and return conversations with metadata only.
+    """
+
+    def __init__(self, db: SQLiteDatabase, max_conversations: int = 1000, max_bytes: int = 100 * 1024 * 1024,
+                 window_tokens: int = 4000):
+        self.db = db
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.window_tokens = window_tokens
+        self.evictions = 0
+        self._cache: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._nbytes = 0
+        self._last_write: Dict[str, int] = {}  # Conversation ID -> sequence number of its last queued write
+        # Conversation ID -> number of cached messages known to sit at their stored positions. Messages
+        # appended here may be stored after another worker's, so the rest are re-read on the next load.
+        self._synced: Dict[str, int] = {}
+        self._offset: Dict[str, int] = {}  # Conversation ID -> stored position of the first cached message
+
+    def __len__(self) -> int:
+        return self.db.query_one("SELECT COUNT(*) FROM conversations WHERE update_seq > 0")[0]
+
+    def _has_pending_writes(self, conversation_id: str) -> bool:
+        seq = self._last_write.get(conversation_id)
+        if seq is not None and seq <= self.db.committed_seq:
+            del self._last_write[conversation_id]
+            return False
+        return seq is not None
+
+    async def get(self, conversation_id: str) -> Optional[Conversation]:
+        """Return a conversation with its recent messages, loading any added by other workers"""
+        while True:
+            conversation = self._cache.get(conversation_id)
+            pending = self._has_pending_writes(conversation_id)
+            if pending:
+                # Our own writes are newer than the stored row
+                row = rows = terms = None
+                break
+            state = self._cache_state(conversation_id)
+            row, rows, terms = await asyncio.to_thread(
+                self.db.snapshot, self._read_conversation, conversation_id,
+                conversation.message_count if conversation is not None else None, self._synced.get(conversation_id, 0)
+            )
+            if self._cache_state(conversation_id) == state:
+                break
+            # Changed here while reading (a message was added or another get() loaded it); read again
+        if pending:
+            pass
+        elif row is None:
+            if conversation is not None and conversation.message_count:
+                # Deleted by another worker
+                self._drop(conversation_id)
+                return None
+        elif terms is not None:
+            conversation = self._load(conversation_id, row, rows, terms)
+        elif rows is not None:
+            self._load_messages(conversation_id, conversation, rows)
+            self._apply_row(conversation, row)
+            # Rebuilt from the messages on next use
+            conversation.context = None
+        elif conversation is not None:
+            # Nothing was stored after our own appends, so they are at the positions we gave them
+            self._synced[conversation_id] = conversation.message_count
+        if conversation is not None:
+            conversation.last_access = time.monotonic()
+            self._cache.move_to_end(conversation_id)
+            self._nbytes += conversation.sync_context_nbytes()
+        return conversation
+
+    async def get_or_create(self, conversation_id: str) -> Conversation:
+        conversation = await self.get(conversation_id)
+        if conversation is None:
+            conversation = Conversation()
+            self._cache_put(conversation_id, conversation)
+        return conversation
+
+    def add_message(self, conversation_id: str, role: str, content: str) -> Message:
+        """Append a message to the cached conversation and queue its write; see flush()"""
+        conversation = self._cache.get(conversation_id)
+        if conversation is None:
+            # Evicted since the caller loaded it: append to an empty copy, which the next get() after
+            # flushing reloads from the store
+            conversation = Conversation()
+            self._cache_put(conversation_id, conversation)
+        message = Message(role, content)
+        conversation.messages.append(message)
+        conversation.message_count += 1
+        conversation.nbytes += message.nbytes
+        self._nbytes += message.nbytes + conversation.sync_context_nbytes()
+        conversation.updated_at = time.time()
+        title = None
+        if conversation.title is None and role == "user":
+            title = conversation.title = make_title(content)
+        new_terms = set(tokenize(content)) - conversation.terms
+        conversation.terms |= new_terms
+
+        db = self.db
+        db.queue(
+            "INSERT OR IGNORE INTO conversations (id, created_at, updated_at) VALUES (?, ?, ?)",
+            (conversation_id, conversation.created_at, conversation.updated_at)
+        )
+        # The position is read inside the write transaction, so it is right even if another worker appended first
+        db.queue(
+            "INSERT INTO messages (conversation_id, position, role, content) "
+            "SELECT ?, message_count, ?, ? FROM conversations WHERE id = ?",
+            (conversation_id, role, content, conversation_id)
+        )
+        # update_seq is assigned inside the write transaction, so it is unique across workers
+        db.queue(
+            "UPDATE conversations SET title = COALESCE(title, ?), updated_at = ?, message_count = message_count + 1, "
+            "update_seq = (SELECT COALESCE(MAX(update_seq), 0) + 1 FROM conversations) WHERE id = ?",
+            (title, conversation.updated_at, conversation_id)
+        )
+        seq = db.queue(
+            "INSERT OR IGNORE INTO conversation_terms (term, conversation_id) VALUES (?, ?)",
+            [(term, conversation_id) for term in new_terms], many=True
+        )
+        self._last_write[conversation_id] = seq
+        self._trim(conversation_id, conversation)
+        self._evict_over_budget(keep=conversation_id)
+        return message
+
+    async def flush(self):
+        """Commit queued writes so other workers see them"""
+        await self.db.flush()
+
+    def delete(self, conversation_id: str) -> bool:
+        existed = self._drop(conversation_id) is not None
+        existed = existed or self.db.query_one("SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)) is not None
+        self.db.queue("DELETE FROM conversation_terms WHERE conversation_id = ?", (conversation_id,))
+        self.db.queue("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+        self._last_write[conversation_id] = self.db.queue("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+        return existed
+
+    def recent(self, limit: int, before: Optional[int] = None) -> Tuple[List[Tuple[str, Conversation]], Optional[int]]:
+        """A page of conversations with messages, most recently updated first (metadata only)"""
+        rows = self.db.query(
+            f"SELECT {CONVERSATION_COLUMNS} FROM conversations WHERE update_seq > 0 AND update_seq < ? "
+            "ORDER BY update_seq DESC LIMIT ?",
+            (before if before is not None else 2 ** 62, limit + 1)
+        )
+        return self._page(rows, limit)
+
+    def search(self, query: str, limit: int, before: Optional[int] = None) -> Tuple[List[Tuple[str, Conversation]], Optional[int]]:
+        """A page of conversations containing every term of query, most recently updated first (metadata only)"""
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return [], None
+        columns = ", ".join(f"c.{column.strip()}" for column in CONVERSATION_COLUMNS.split(","))
+        rows = self.db.query(
+            f"SELECT {columns} FROM conversation_terms t JOIN conversations c ON c.id = t.conversation_id "
+            f"WHERE t.term IN ({', '.join('?' * len(terms))}) AND c.update_seq > 0 AND c.update_seq < ? "
+            "GROUP BY c.id HAVING COUNT(*) = ? ORDER BY c.update_seq DESC LIMIT ?",
+            (*terms, before if before is not None else 2 ** 62, len(terms), limit + 1)
+        )
+        return self._page(rows, limit)
+
+    async def count_messages(self, conversation_id: str) -> int:
+        """Number of messages in a conversation, without loading them"""
+        conversation = self._cache.get(conversation_id)
+        if conversation is not None and self._has_pending_writes(conversation_id):
+            return conversation.message_count
+        row = await asyncio.to_thread(
+            self.db.query_one, "SELECT message_count FROM conversations WHERE id = ?", (conversation_id,)
+        )
+        return row[0] if row else 0
+
+    async def messages(self, conversation_id: str, start: int, stop: int) -> List[Message]:
+        """Messages [start, stop) of a conversation, read by position rather than loading the whole history"""
+        conversation = self._cache.get(conversation_id)
+        cached = []
+        if conversation is not None and self._has_pending_writes(conversation_id):
+            # Unflushed messages are only in the cache; older ones may be outside its window
+            offset = self._offset.get(conversation_id, 0)
+            cached = conversation.messages[max(start - offset, 0):max(stop - offset, 0)]
+            stop = min(stop, offset)
+        if start >= stop:
+            return cached
+        rows = await asyncio.to_thread(
+            self.db.query,
+            "SELECT role, content FROM messages WHERE conversation_id = ? AND position >= ? AND position < ? ORDER BY position",
+            (conversation_id, start, stop)
+        )
+        return [Message(role, content) for role, content in rows] + cached
+
+    def snippet(self, conversation_id: str, terms: Set[str], width: int = 120) -> str:
+        """Text around the first occurrence of a search term"""
+        if not terms:
+            return ""
+        row = self.db.query_one(
+            f"SELECT content FROM messages WHERE conversation_id = ? AND ({' OR '.join(['lower(content) LIKE ?'] * len(terms))}) "
+            "ORDER BY position LIMIT 1",
+            (conversation_id, *(f"%{term}%" for term in terms))
+        )
+        return make_snippet(row[0], terms, width) if row else ""
+
+    def items(self):
+        """Iterate cached conversations from least to most recently used"""
+        return iter(list(self._cache.items()))
+
+    def memory_usage(self) -> Dict:
+        """Approximate memory held by cached conversations"""
+        return {
+            "conversations": len(self._cache),
+            "messages": sum(len(c.messages) for c in self._cache.values()),
+            "bytes": self._nbytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "pending_writes": self.db.pending
+        }
+
+    def _page(self, rows: List[tuple], limit: int) -> Tuple[List[Tuple[str, Conversation]], Optional[int]]:
+        page = []
+        for row in rows[:limit]:
+            conversation = Conversation()
+            self._apply_row(conversation, row)
+            page.append((row[0], conversation))
+        return page, (rows[limit - 1][5] if len(rows) > limit else None)
+
+    def _apply_row(self, conversation: Conversation, row: tuple):
+        _, conversation.title, conversation.created_at, conversation.updated_at, conversation.message_count, conversation.update_seq = row
+
+    def _cache_state(self, conversation_id: str) -> tuple:
+        conversation = self._cache.get(conversation_id)
+        return (
+            conversation, conversation.message_count if conversation is not None else None,
+            self._last_write.get(conversation_id), self._synced.get(conversation_id)
+        )
+
+    def _read_conversation(self, conn: sqlite3.Connection, conversation_id: str, cached_count: Optional[int],
+                           synced: int) -> Tuple[Optional[tuple], Optional[List[tuple]], Optional[List[str]]]:
+        """What get() needs, read in a worker thread: the row, plus either the recent messages and terms
+        (not cached, or the stored history was replaced) or the messages stored from position synced on"""
+        row = conn.execute(f"SELECT {CONVERSATION_COLUMNS} FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None, None, None
+        if cached_count is None or row[4] < cached_count:
+            terms = [term for (term,) in conn.execute("SELECT term FROM conversation_terms WHERE conversation_id = ?", (conversation_id,))]
+            return row, self._window_rows(conn, conversation_id, 0), terms
+        if row[4] > cached_count:
+            return row, self._window_rows(conn, conversation_id, synced), None
+        return row, None, None
+
+    def _window_rows(self, conn: sqlite3.Connection, conversation_id: str, start: int) -> List[tuple]:
+        """(position, role, content) of the messages from start on, but only the latest window_tokens worth"""
+        rows, tokens = [], 0
+        cursor = conn.execute(
+            "SELECT position, role, content FROM messages WHERE conversation_id = ? AND position >= ? ORDER BY position DESC",
+            (conversation_id, start)
+        )
+        for row in cursor:
+            rows.append(row)
+            tokens += estimate_tokens(row[2])
+            if tokens > self.window_tokens:
+                break
+        rows.reverse()
+        return rows
+
+    def _load(self, conversation_id: str, row: tuple, rows: List[tuple], terms: List[str]) -> Conversation:
+        self._drop(conversation_id)
+        conversation = Conversation()
+        self._load_messages(conversation_id, conversation, rows)
+        self._apply_row(conversation, row)
+        conversation.terms.update(terms)
+        self._cache_put(conversation_id, conversation)
+        return conversation
+
+    def _load_messages(self, conversation_id: str, conversation: Conversation, rows: List[tuple]):
+        """Append stored messages read by _window_rows(), replacing any appended here since the last load"""
+        offset = self._offset.get(conversation_id, 0)
+        synced = self._synced.get(conversation_id, 0)
+        keep = max(0, min(synced - offset, len(conversation.messages)))
+        if rows and rows[0][0] > synced:
+            # More was added than fits the window; the cached messages are older than all of it
+            keep = 0
+        if keep == 0:
+            offset = rows[0][0] if rows else synced
+        self._remove_messages(conversation_id, conversation, keep, len(conversation.messages))
+        for _, role, content in rows:
+            message = Message(role, content)
+            conversation.messages.append(message)
+            conversation.nbytes += message.nbytes
+            if conversation_id in self._cache:
+                self._nbytes += message.nbytes
+        self._offset[conversation_id] = offset
+        conversation.message_count = offset + len(conversation.messages)
+        self._synced[conversation_id] = conversation.message_count
+        self._trim(conversation_id, conversation)
+
+    def _trim(self, conversation_id: str, conversation: Conversation):
+        """Drop cached messages older than the latest window_tokens worth"""
+        tokens, keep = 0, 0
+        for message in reversed(conversation.messages):
+            keep += 1
+            tokens += estimate_tokens(message.content)
+            if tokens > self.window_tokens:
+                break
+        drop = len(conversation.messages) - keep
+        if drop:
+            self._remove_messages(conversation_id, conversation, 0, drop)
+            self._offset[conversation_id] = self._offset.get(conversation_id, 0) + drop
+
+    def _remove_messages(self, conversation_id: str, conversation: Conversation, start: int, stop: int):
+        for message in conversation.messages[start:stop]:
+            conversation.nbytes -= message.nbytes
+            if conversation_id in self._cache:
+                self._nbytes -= message.nbytes
+        del conversation.messages[start:stop]
+
+    def _cache_put(self, conversation_id: str, conversation: Conversation):
+        self._cache[conversation_id] = conversation
+        self._nbytes += conversation.nbytes
+        self._evict_over_budget(keep=conversation_id)
+
+    def _drop(self, conversation_id: str) -> Optional[Conversation]:
+        conversation = self._cache.pop(conversation_id, None)
+        self._synced.pop(conversation_id, None)
+        self._offset.pop(conversation_id, None)
+        if conversation is not None:
+            self._nbytes -= conversation.nbytes
+        return conversation
+
+    def _evict_over_budget(self, keep: str):
+        # Evicting only drops the cached copy; conversations with unflushed writes stay
+        for conversation_id in list(self._cache):
+            if len(self._cache) <= self.max_conversations and self._nbytes <= self.max_bytes:
+                break
+            if conversation_id != keep and not self._has_pending_writes(conversation_id):
+                self._drop(conversation_id)
+                self.evictions += 1
+
+
+def _insert_file(conn: sqlite3.Connection, file_id: str, info: Dict, blob: BinaryIO, chunk_size: int = 1024 * 1024):
+    """Add a file row, storing its content only if no identical content is stored yet (runs on the writer thread)"""
+    sha256 = info["sha256"]
+    if conn.execute("UPDATE blobs SET refs = refs + 1 WHERE sha256 = ?", (sha256,)).rowcount == 0:
+        # Stream the spooled upload into a preallocated blob instead of building one large bytes object
+        rowid = conn.execute(
+            "INSERT INTO blobs (sha256, data, refs) VALUES (?, zeroblob(?), 1)", (sha256, info["size"])
+        ).lastrowid
+        blob.seek(0)
+        with conn.blobopen("blobs", "data", rowid) as stored:
+            while True:
+                chunk = blob.read(chunk_size)
+                if not chunk:
+                    break
+                stored.write(chunk)
+    conn.execute(
+        "INSERT INTO files (file_id, filename, content_type, size, sha256, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (file_id, info["filename"], info["content_type"], info["size"], sha256, time.time())
+    )
+
+
+class SQLiteFileStore(FileStore):
+    """File metadata and content stored in SQLite, deduplicated by SHA-256"""
+
+    def __init__(self, db: SQLiteDatabase, spool_threshold: int = 1024 * 1024):
+        self.db = db
+        self.spool_threshold = spool_threshold
+
+    def new_blob(self) -> BinaryIO:
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_threshold)
+
+    async def add(self, file_id: str, info: Dict, blob: BinaryIO):
+        # Committed before returning: the file ID is handed out right after this and any worker must be able to find it
+        try:
+            await self.db.transaction(_insert_file, file_id, info, blob)
+        finally:
+            blob.close()
+
+    def get(self, file_id: str) -> Optional[Dict]:
+        row = self.db.query_one("SELECT filename, content_type, size, sha256 FROM files WHERE file_id = ?", (file_id,))
+        if row is None:
+            return None
+        return {"filename": row[0], "content_type": row[1], "size": row[2], "sha256": row[3]}
+
+    async def read(self, sha256: str, limit: Optional[int] = None) -> bytes:
+        if limit is None:
+            row = await asyncio.to_thread(self.db.query_one, "SELECT data FROM blobs WHERE sha256 = ?", (sha256,))
+        else:
+            row = await asyncio.to_thread(self.db.query_one, "SELECT substr(data, 1, ?) FROM blobs WHERE sha256 = ?", (limit, sha256))
+        if row is None:
+            raise KeyError(sha256)
+        return row[0]
+
+    async def delete(self, file_id: str) -> Optional[str]:
+        info = self.get(file_id)
+        if info is None:
+            return None
+        sha256 = info["sha256"]
+        self.db.queue("DELETE FROM files WHERE file_id = ?", (file_id,))
+        self.db.queue("UPDATE blobs SET refs = refs - 1 WHERE sha256 = ?", (sha256,))
+        self.db.queue("DELETE FROM blobs WHERE sha256 = ? AND refs <= 0", (sha256,))
+        await self.db.flush()
+        if self.db.query_one("SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)) is None:
+            return sha256
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "files": self.db.query_one("SELECT COUNT(*) FROM files")[0],
+            "blobs": self.db.query_one("SELECT COUNT(*) FROM blobs")[0]
+        }
@@ -0,0 +1,47 @@
+import importlib
+import sys
+import time
+from typing import Any, Dict, Optional
+
+# Timings behind /api/diagnostics/startup; written once per import or service, so no locking
+_app_import_seconds: Optional[float] = None
+_imports: Dict[str, float] = {}
+_services: Dict[str, Dict] = {}
+
+
+def lazy_import(name: str) -> Any:
+    """Import a module on first use and record how long the import took"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    _imports[name] = time.perf_counter() - start
+    return module
+
+
+def optional_import(name: str) -> Any:
+    """lazy_import() for optional dependencies: None when the module is not installed"""
+    try:
+        return lazy_import(name)
+    except Exception:
+        return None
+
+
+def record_app_import(seconds: float):
+    global _app_import_seconds
+    _app_import_seconds = seconds
+
+
+def record_service(name: str, seconds: float, new_modules: int):
+    _services[name] = {"construct_seconds": round(seconds, 4), "modules_loaded": new_modules}
+
+
+def report() -> Dict:
+    """Import and construction times recorded so far in this process"""
+    return {
+        "app_import_seconds": round(_app_import_seconds, 4) if _app_import_seconds is not None else None,
+        "lazy_imports": {name: round(seconds, 4) for name, seconds in sorted(_imports.items(), key=lambda item: -item[1])},
+        "services": dict(_services),
+        "modules_loaded": len(sys.modules)
+    }
@@ -0,0 +1,154 @@
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from backend.compression import choose_encoding
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+# Served with a content hash in the name, e.g. script.3f2a1b9c04de.js
+HASHED_NAME = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[^./]+)$")
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class Asset:
+    """One file with its precompressed variants"""
+
+    __slots__ = ("content_type", "digest", "variants", "mtime")
+
+    def __init__(self, content: bytes, content_type: str, mtime: float):
+        self.content_type = content_type
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        self.mtime = mtime
+        self.variants: Dict[str, bytes] = {"identity": content}
+        if content_type.startswith(COMPRESSIBLE_TYPES) and len(content) > 256:
+            if brotli is not None:
+                compressed = brotli.compress(content, quality=11)
+                if len(compressed) < len(content):
+                    self.variants["br"] = compressed
+            compressed = gzip.compress(content, 9)
+            if len(compressed) < len(content):
+                self.variants["gzip"] = compressed
+
+    def etag(self, encoding: str) -> str:
+        # Strong validators must differ per content coding
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+
+class StaticAssets:
+    """In-memory, precompressed frontend assets with content-hashed URLs.
+
+    Files under static_dir are hashed and compressed with gzip (and brotli
+    when the brotli package is installed) once, and index.html is rewritten
+    to reference /static/<name>.<hash>.<ext> URLs that are served as
+    immutable. Everything is sent with a strong ETag and answers
+    If-None-Match with 304. With watch (for development), assets are reloaded
+    when a file changes on disk, checked whenever index.html is served.
+    Loading and checking run in a worker thread.
+    """
+
+    def __init__(self, frontend_dir: str = "frontend", static_dir: str = "frontend/static", url_prefix: str = "/static/",
+                 watch: bool = False):
+        self.frontend_dir = frontend_dir
+        self.static_dir = static_dir
+        self.url_prefix = url_prefix
+        self.watch = watch
+        self._assets: Dict[str, Asset] = {}
+        self._index: Optional[Asset] = None
+        self._index_mtime = 0.0
+        self._lock = asyncio.Lock()  # One rebuild at a time
+
+    def load(self):
+        """(Re)build all assets and the rewritten index page"""
+        assets = {}
+        for directory, _, filenames in os.walk(self.static_dir):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    content = f.read()
+                # Starlette adds the charset to text/* types itself
+                content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                if content_type == "application/javascript":
+                    content_type += "; charset=utf-8"
+                assets[name] = Asset(content, content_type, os.path.getmtime(path))
+
+        index_path = os.path.join(self.frontend_dir, "index.html")
+        with open(index_path, "r", encoding="utf-8") as f:
+            html = f.read()
+        for name, asset in assets.items():
+            # index.html refers to assets as "static/x" or "/static/x"
+            html = re.sub(
+                r'(["\'])/?' + re.escape(self.url_prefix.strip("/") + "/" + name) + r'\1',
+                lambda match: match.group(1) + self.url_for(name, asset) + match.group(1),
+                html
+            )
+        self._assets = assets
+        self._index = Asset(html.encode("utf-8"), "text/html", 0.0)
+        self._index_mtime = os.path.getmtime(index_path)
+
+    def url_for(self, name: str, asset: Asset) -> str:
+        stem, ext = os.path.splitext(name)
+        return f"{self.url_prefix}{stem}.{asset.digest}{ext}"
+
+    def _stale(self) -> bool:
+        try:
+            if os.path.getmtime(os.path.join(self.frontend_dir, "index.html")) != self._index_mtime:
+                return True
+            return any(
+                os.path.getmtime(os.path.join(self.static_dir, name)) != asset.mtime
+                for name, asset in self._assets.items()
+            )
+        except OSError:
+            return True
+
+    async def refresh(self):
+        """Load the assets if not loaded yet and, when watching, rebuild them if a file changed"""
+        if self._index is not None and not self.watch:
+            return
+        async with self._lock:
+            if self._index is None or await asyncio.to_thread(self._stale):
+                await asyncio.to_thread(self.load)
+
+    async def index_response(self, request: Request) -> Response:
+        await self.refresh()
+        return self._response(request, self._index, REVALIDATE)
+
+    async def static_response(self, request: Request, path: str) -> Optional[Response]:
+        """Response for /static/<path>, or None if there is no such asset"""
+        if self._index is None:
+            await self.refresh()
+        asset = self._assets.get(path)
+        if asset is not None:
+            # Unversioned URL: the content can change, so clients must revalidate
+            return self._response(request, asset, REVALIDATE)
+        match = HASHED_NAME.match(path)
+        if match:
+            asset = self._assets.get(match.group("stem") + match.group("ext"))
+            if asset is not None:
+                # A page from before the last change may ask for an old hash; serve the current file uncached
+                return self._response(request, asset, IMMUTABLE if asset.digest == match.group("hash") else REVALIDATE)
+        return None
+
+    def _response(self, request: Request, asset: Asset, cache_control: str) -> Response:
+        encoding = choose_encoding(request.headers.get("accept-encoding"), [e for e in ("br", "gzip") if e in asset.variants])
+        etag = asset.etag(encoding)
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], media_type=asset.content_type, headers=headers)
@@ -0,0 +1,125 @@
+import os
+import tempfile
+from typing import BinaryIO, Dict, Optional
+
+STORAGE_BACKENDS = ("memory", "sqlite")
+
+
+class FileStore:
+    """Interface for uploaded file metadata and content.
+
+    File metadata is a dict with filename, content_type, size and sha256.
+    Content is stored once per SHA-256 and reference counted, so identical
+    uploads share it.
+    """
+
+    def new_blob(self) -> BinaryIO:
+        """Writable buffer an upload is streamed into before add()"""
+        raise NotImplementedError
+
+    async def add(self, file_id: str, info: Dict, blob: BinaryIO):
+        """Store metadata and content; takes ownership of blob"""
+        raise NotImplementedError
+
+    def get(self, file_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def read(self, sha256: str, limit: Optional[int] = None) -> bytes:
+        """Stored content, or only its first limit bytes"""
+        raise NotImplementedError
+
+    async def delete(self, file_id: str) -> Optional[str]:
+        """Remove a file; returns its SHA-256 if no other file references the content any more"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        raise NotImplementedError
+
+    def __contains__(self, file_id: str) -> bool:
+        return self.get(file_id) is not None
+
+
+class MemoryFileStore(FileStore):
+    """Per-process file store; content is spooled to disk above spool_threshold bytes"""
+
+    def __init__(self, spool_threshold: int = 1024 * 1024):
+        self.spool_threshold = spool_threshold
+        self.files: Dict[str, Dict] = {}  # File metadata by file ID
+        self.blobs: Dict[str, Dict] = {}  # Spooled content and reference count by SHA-256
+
+    def new_blob(self) -> BinaryIO:
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_threshold)
+
+    async def add(self, file_id: str, info: Dict, blob: BinaryIO):
+        sha256 = info["sha256"]
+        if sha256 in self.blobs:
+            # Identical content already stored; keep a single copy
+            blob.close()
+            self.blobs[sha256]["refs"] += 1
+        else:
+            self.blobs[sha256] = {"blob": blob, "refs": 1}
+        self.files[file_id] = info
+
+    def get(self, file_id: str) -> Optional[Dict]:
+        return self.files.get(file_id)
+
+    async def read(self, sha256: str, limit: Optional[int] = None) -> bytes:
+        blob = self.blobs[sha256]["blob"]
+        blob.seek(0)
+        return blob.read() if limit is None else blob.read(limit)
+
+    async def delete(self, file_id: str) -> Optional[str]:
+        info = self.files.pop(file_id, None)
+        if info is None:
+            return None
+        sha256 = info["sha256"]
+        stored = self.blobs.get(sha256)
+        if stored is None:
+            return None
+        stored["refs"] -= 1
+        if stored["refs"] > 0:
+            return None
+        del self.blobs[sha256]
+        stored["blob"].close()
+        return sha256
+
+    def stats(self) -> Dict:
+        return {"files": len(self.files), "blobs": len(self.blobs)}
+
+
+def storage_backend() -> str:
+    """Backend selected by STORAGE_BACKEND: "memory" (per process) or "sqlite" (shared by all workers)"""
+    backend = os.getenv("STORAGE_BACKEND", "memory").lower()
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'; expected one of {', '.join(STORAGE_BACKENDS)}")
+    return backend
+
+
+_database = None
+
+
+def get_database():
+    """Process-wide SQLite database at STORAGE_PATH"""
+    global _database
+    if _database is None:
+        from backend.sqlite_storage import SQLiteDatabase
+        _database = SQLiteDatabase(os.getenv("STORAGE_PATH", "data/chatclone.db"))
+    return _database
+
+
+def create_conversation_store(max_conversations: int, idle_ttl: float, max_bytes: int, window_tokens: int):
+    if storage_backend() == "sqlite":
+        from backend.sqlite_storage import SQLiteConversationStore
+        # Stored conversations persist; the limits bound the per-process cache
+        return SQLiteConversationStore(
+            get_database(), max_conversations=max_conversations, max_bytes=max_bytes, window_tokens=window_tokens
+        )
+    from backend.conversation_store import ConversationStore
+    return ConversationStore(max_conversations=max_conversations, idle_ttl=idle_ttl, max_bytes=max_bytes)
+
+
+def create_file_store(spool_threshold: int) -> FileStore:
+    if storage_backend() == "sqlite":
+        from backend.sqlite_storage import SQLiteFileStore
+        return SQLiteFileStore(get_database(), spool_threshold=spool_threshold)
+    return MemoryFileStore(spool_threshold)
@@ -0,0 +1,202 @@
+import asyncio
+import ipaddress
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from backend.startup import optional_import
+
+# httpx and bs4 are imported on first use, keeping them off the cold-start path
+
+
+class SearchProvider:
+    """Interface for web search backends used by the research agent"""
+
+    name = "base"
+    # Whether result links point at real pages worth fetching
+    fetch_pages = True
+
+    async def search(self, query: str) -> List[Dict]:
+        """Return results as dicts with title, link and snippet keys"""
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class LocalSearchProvider(SearchProvider):
+    """Simulated results; the default when no search backend is configured"""
+
+    name = "local"
+    fetch_pages = False
+
+    async def search(self, query: str) -> List[Dict]:
+        # This is a simplified simulation placeholder for web search
+        return [
+            {
+                "title": f"Search result for: {query}",
+                "link": "https://example.com",
+                "snippet": f"This is a simulated search result for the query: {query}. In a real implementation, this would contain actual web search results from a search API."
+            }
+        ]
+
+
+class HTTPSearchProvider(SearchProvider):
+    """Search backend reached over HTTP.
+
+    Sends GET {endpoint}?q=<query> and expects a JSON list of results (or an
+    object with a "results" list) using the title/link/snippet keys. Pointing
+    the endpoint at a local stand-in server makes the pipeline testable offline.
+    """
+
+    name = "http"
+
+    def __init__(self, endpoint: str, api_key: Optional[str] = None, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.timeout = timeout
+        self._client = None
+
+    async def search(self, query: str) -> List[Dict]:
+        if self._client is None:
+            self._client = optional_import("httpx").AsyncClient(timeout=self.timeout)
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        response = await self._client.get(self.endpoint, params={"q": query}, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        results = data.get("results", []) if isinstance(data, dict) else data
+        return [
+            {"title": item.get("title", ""), "link": item.get("link", ""), "snippet": item.get("snippet", "")}
+            for item in results
+            if isinstance(item, dict)
+        ]
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_search_provider() -> SearchProvider:
+    """Build the search provider selected by SEARCH_PROVIDER"""
+    provider = os.getenv("SEARCH_PROVIDER", "local").lower()
+    if provider == "http" and os.getenv("SEARCH_API_URL") and optional_import("httpx") is not None:
+        return HTTPSearchProvider(os.getenv("SEARCH_API_URL"), os.getenv("SEARCH_API_KEY"))
+    return LocalSearchProvider()
+
+
+def _html_to_text(html: str, max_chars: int) -> str:
+    """Visible text of an HTML page (runs in the parser pool)"""
+    soup = optional_import("bs4").BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "header", "footer", "nav"]):
+        tag.decompose()
+    return " ".join(soup.get_text(" ", strip=True).split())[:max_chars]
+
+
+async def _is_public_host(host: str, port: int) -> bool:
+    """Whether every address host resolves to is publicly routable (not loopback, private, link-local...)"""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        return False
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            return False
+    return bool(infos)
+
+
+class PageFetcher:
+    """Fetches result pages concurrently over a pooled HTTP client.
+
+    Each fetch, redirects included, has an overall timeout and a size cap;
+    HTML is parsed in a worker pool so large pages do not hold up the event
+    loop. Result links come from the web, so hosts that resolve to loopback,
+    private or link-local addresses are refused, at every redirect hop.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, max_connections: Optional[int] = None,
+                 max_bytes: int = 1024 * 1024, max_chars: int = 3000, max_redirects: int = 5):
+        self.timeout = timeout or float(os.getenv("FETCH_TIMEOUT", 5))
+        self.max_connections = max_connections or int(os.getenv("FETCH_MAX_CONNECTIONS", 10))
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.max_redirects = max_redirects
+        # For offline testing against a stand-in server on this machine
+        self.allow_private = os.getenv("FETCH_ALLOW_PRIVATE", "false").lower() == "true"
+        self._client = None
+        self._parser_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="html")
+
+    def _get_client(self):
+        if self._client is None:
+            httpx = optional_import("httpx")
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=False,  # Followed in _fetch_html, which checks each target
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                headers={"User-Agent": "EnkayLLMChatClone/1.0 (research agent)"}
+            )
+        return self._client
+
+    async def fetch_text(self, url: str) -> Optional[str]:
+        """Readable text of a page, or None if it could not be fetched"""
+        if not url.startswith(("http://", "https://")) or optional_import("httpx") is None or optional_import("bs4") is None:
+            return None
+        try:
+            # httpx's timeout applies to each read; this bounds the whole download
+            html = await asyncio.wait_for(self._fetch_html(url), self.timeout)
+        except Exception:
+            return None
+        if html is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._parser_pool, _html_to_text, html, self.max_chars)
+        except Exception:
+            return None
+
+    async def _fetch_html(self, url: str) -> Optional[str]:
+        for _ in range(self.max_redirects + 1):
+            if not await self._allowed(url):
+                return None
+            async with self._get_client().stream("GET", url) as response:
+                if response.is_redirect and response.next_request is not None:
+                    url = str(response.next_request.url)
+                    continue
+                if response.status_code != 200 or "html" not in response.headers.get("content-type", ""):
+                    return None
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body.extend(chunk)
+                    if len(body) >= self.max_bytes:
+                        break
+                return bytes(body).decode(response.encoding or "utf-8", errors="ignore")
+        return None
+
+    async def _allowed(self, url: str) -> bool:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            return False
+        if self.allow_private:
+            return True
+        return await _is_public_host(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+
+    async def enrich(self, results: List[Dict]) -> List[Dict]:
+        """Fetch all result pages concurrently and attach their text as "content" """
+        pages = await asyncio.gather(*(self.fetch_text(result.get("link", "")) for result in results))
+        enriched = []
+        for result, text in zip(results, pages):
+            if text:
+                result = dict(result, content=text)
+            enriched.append(result)
+        return enriched
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
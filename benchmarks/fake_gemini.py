@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+import random
+from typing import Any, AsyncIterator, Optional
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeStream:
+    """Async iterator of response chunks, like the SDK's streamed response"""
+
+    def __init__(self, chunks, chunk_delay: float):
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+
+    def __aiter__(self) -> AsyncIterator[FakeResponse]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[FakeResponse]:
+        for chunk in self.chunks:
+            await asyncio.sleep(self.chunk_delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGeminiModel:
+    """Stand-in for genai.GenerativeModel with injectable latency, errors and streaming.
+
+    Latency is drawn uniformly from latency +/- jitter, a fraction error_rate
+    of calls raise `error` (a quota error by default, so the retry and rate
+    limiter paths are exercised) and streamed responses are split into
+    chunk_chars pieces with chunk_delay between them. A seed makes the
+    error and latency sequence reproducible.
+    """
+
+    model_name = "fake-gemini"
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0,
+                 error: str = "429 quota exceeded", response_chars: int = 400, chunk_chars: int = 16,
+                 chunk_delay: float = 0.002, seed: Optional[int] = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error = error
+        self.response_chars = response_chars
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+
+    def _response_text(self, prompt: Any) -> str:
+        # Distinct prompts get distinct answers, so downstream caches (e.g. research search terms) see distinct keys
+        digest = hashlib.sha256(str(prompt).encode("utf-8")).hexdigest()[:12]
+        text = f"Fake answer {digest} to a {len(str(prompt))} character prompt. "
+        return (text * (self.response_chars // len(text) + 1))[:self.response_chars]
+
+    async def generate_content_async(self, prompt: Any, stream: bool = False, **kwargs) -> Any:
+        self.calls += 1
+        delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        failed = self._random.random() < self.error_rate
+        await asyncio.sleep(delay)
+        if failed:
+            self.errors += 1
+            raise RuntimeError(self.error)
+
+        text = self._response_text(prompt)
+        if stream:
+            chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+            return FakeStream(chunks, self.chunk_delay)
+        return FakeResponse(text)
@@ -0,0 +1,268 @@
+"""Offline load test of the API against a fake Gemini model.
+
+Drives the FastAPI app in-process through httpx's ASGI transport, so no
+server, network or API key is needed. Example:
+
+    python -m benchmarks.run --scenarios chat,chat_with_file --concurrency 1,8,32 --requests 200
+
+Results (p50/p95/p99 latency, requests per second, peak RSS) are written
+as JSON so runs can be compared across versions. Each scenario and
+concurrency level runs in a fresh interpreter, so its peak RSS is not
+inherited from the runs before it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import httpx
+
+from benchmarks.fake_gemini import FakeGeminiModel
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("chat", "chat_stream", "research", "upload", "chat_with_file")
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB (see run_isolated)"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def file_payload(index: int, size: int) -> bytes:
+    """A text document of about size bytes, unique per index so uploads are not deduplicated"""
+    line = f"Document {index}: quarterly revenue, latency budgets and release notes for service {index}.\n"
+    return (line * (size // len(line) + 1))[:size].encode("utf-8")
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.model = FakeGeminiModel(
+            latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+            response_chars=args.response_chars, chunk_delay=args.chunk_delay, seed=args.seed
+        )
+        self.file_id = None
+
+        from backend import main, services
+        self.services = services
+        # Every service talks to the same fake
+        services.get_chat_service().model = self.model
+        services.get_research_agent().model = self.model
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=None)
+
+    def reset_caches(self):
+        """Start every run with cold response caches, so results do not depend on which runs came before"""
+        from backend.model_client import get_model_client
+        from backend.similarity_cache import create_similarity_cache
+        get_model_client().cache.clear()
+        research_agent = self.services.get_research_agent()
+        for cache in (research_agent.search_terms_cache, research_agent.search_results_cache, research_agent.analysis_cache):
+            cache.clear()
+        research_agent.similarity_cache = create_similarity_cache("research")
+        chat_service = self.services.get_chat_service()
+        chat_service.similarity_cache = create_similarity_cache("chat")
+
+    async def setup(self, scenario: str):
+        self.reset_caches()
+        if scenario == "chat_with_file" and self.file_id is None:
+            files = {"file": ("bench.txt", file_payload(0, self.args.file_size), "text/plain")}
+            response = await self.client.post("/api/upload", files=files)
+            response.raise_for_status()
+            self.file_id = response.json()["file_id"]
+
+    def request(self, scenario: str) -> Callable[[int], "asyncio.Future"]:
+        client = self.client
+
+        def prompt(index: int) -> str:
+            # Distinct prompts unless repeats are asked for, so caches and coalescing do not skew the numbers
+            return "Summarize the benchmark topic" if self.args.repeat_prompts else f"Benchmark question {index}"
+
+        if scenario == "chat":
+            return lambda i: client.post("/api/chat", json={"message": prompt(i)})
+        if scenario == "chat_stream":
+            return lambda i: client.post("/api/chat/stream", json={"message": prompt(i)})
+        if scenario == "research":
+            return lambda i: client.post("/api/chat", json={"message": prompt(i), "use_research": True})
+        if scenario == "upload":
+            return lambda i: client.post(
+                "/api/upload", files={"file": (f"bench-{i}.txt", file_payload(i, self.args.file_size), "text/plain")}
+            )
+        if scenario == "chat_with_file":
+            return lambda i: client.post("/api/chat-with-file", data={"message": prompt(i), "file_id": self.file_id})
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    async def run(self, scenario: str, concurrency: int) -> Dict:
+        await self.setup(scenario)
+        send = self.request(scenario)
+        latencies: List[float] = []
+        errors = 0
+        next_index = iter(range(self.args.requests))
+        calls_before = self.model.calls
+
+        async def worker():
+            nonlocal errors
+            for index in next_index:
+                start = time.perf_counter()
+                try:
+                    response = await send(index)
+                    if response.status_code >= 400:
+                        errors += 1
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        return {
+            "scenario": scenario,
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": errors,
+            "duration_s": round(elapsed, 3),
+            "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            "model_calls": self.model.calls - calls_before,
+            "peak_rss_mb": round(peak_rss_mb(), 1)
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+        await self.services.get_research_agent().aclose()
+
+
+async def run_one(args: argparse.Namespace) -> Dict:
+    bench = Benchmark(args)
+    try:
+        return await bench.run(args.scenarios[0], args.concurrency[0])
+    finally:
+        await bench.aclose()
+
+
+def run_isolated(argv: List[str], scenario: str, concurrency: int) -> Dict:
+    """One scenario at one concurrency level in a fresh interpreter.
+
+    ru_maxrss is a process-wide high-water mark, so runs sharing a process
+    would all report the largest peak seen so far.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", *argv, "--scenarios", scenario, "--concurrency", str(concurrency), "--worker"],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_all(args: argparse.Namespace, argv: List[str]) -> Dict:
+    results = []
+    for scenario in args.scenarios:
+        for concurrency in args.concurrency:
+            result = run_isolated(argv, scenario, concurrency)
+            results.append(result)
+            print(
+                f"{scenario:<15} c={concurrency:<4} rps={result['rps']:<9} p50={result['p50_ms']}ms "
+                f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms errors={result['errors']} "
+                f"rss={result['peak_rss_mb']}MiB"
+            )
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_model": {
+                "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+                "response_chars": args.response_chars, "chunk_delay": args.chunk_delay, "seed": args.seed
+            },
+            "requests_per_run": args.requests,
+            "file_size": args.file_size,
+            "repeat_prompts": args.repeat_prompts
+        },
+        "results": results
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and concurrency level")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Uniform latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake model calls that raise a quota error")
+    parser.add_argument("--response-chars", type=int, default=400, help="Length of fake responses")
+    parser.add_argument("--chunk-delay", type=float, default=0.002, help="Delay between streamed chunks in seconds")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="Size of uploaded benchmark documents in bytes")
+    parser.add_argument("--repeat-prompts", action="store_true", help="Send the same prompt every time to measure caching and coalescing")
+    parser.add_argument("--rate-limit", action="store_true", help="Keep the configured Gemini RPM/TPM limits instead of disabling them")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file to write results to")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)  # One run, printed as JSON (see run_isolated)
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    return args
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = parse_args(argv)
+    output = Path(args.output).resolve()
+    # The app resolves frontend paths relative to the working directory
+    os.chdir(REPO_ROOT)
+    if not args.rate_limit:
+        # The limiter would measure the configured quota, not the service
+        os.environ["GEMINI_RPM_LIMIT"] = "0"
+        os.environ["GEMINI_TPM_LIMIT"] = "0"
+
+    if args.worker:
+        print(json.dumps(asyncio.run(run_one(args))))
+        return
+    report = run_all(args, argv)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,10 @@
 let currentConversationId = null;
 let uploadedFile = null;
 let isTyping = false;
+let earliestMessageCursor = null;  // Pass as `before` to load older messages of the open conversation
+const HISTORY_PAGE_SIZE = 50;
+const OWN_CONVERSATIONS_KEY = 'chatclone.conversations';  // Conversations started in this browser
+const MAX_OWN_CONVERSATIONS = 20;
 
 // Initialize the application
 document.addEventListener('DOMContentLoaded', function() {
@@ -16,6 +20,8 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Focus on input
     messageInput.focus();
+
+    loadConversationList();
 });
 
 // Handle keyboard shortcuts
@@ -58,17 +64,26 @@ async function sendMessage() {
             // Send message with file
             response = await sendMessageWithFile(message, uploadedFile.file_id, useResearch);
             removeFile(); // Clear file after sending
+            
+            // Hide typing indicator and add response
+            hideTypingIndicator();
+            addMessage(response.response, 'assistant');
         } else {
-            // Send regular message
-            response = await sendRegularMessage(message, useResearch);
+            // Stream regular message, rendering tokens as they arrive
+            if (window.ReadableStream && window.TextDecoder) {
+                response = await sendStreamingMessage(message, useResearch);
+            } else {
+                // Browsers without streamed fetch bodies get the whole reply at once
+                response = await sendRegularMessage(message, useResearch);
+                hideTypingIndicator();
+                addMessage(response.response, 'assistant');
+            }
         }
         
-        // Hide typing indicator and add response
-        hideTypingIndicator();
-        addMessage(response.response, 'assistant');
-        
         // Update conversation ID
         currentConversationId = response.conversation_id;
+        rememberConversation(response.conversation_id, message);
+        loadConversationList();
         
     } catch (error) {
         hideTypingIndicator();
@@ -98,6 +113,83 @@ async function sendRegularMessage(message, useResearch) {
     return await response.json();
 }
 
+// Send message over the streaming endpoint (Server-Sent Events)
+async function sendStreamingMessage(message, useResearch) {
+    const response = await fetch('/api/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            message: message,
+            conversation_id: currentConversationId,
+            use_research: useResearch
+        })
+    });
+    
+    if (!response.ok || !response.body) {
+        throw new Error('Failed to send message');
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    let messageContent = null;
+    let result = null;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const event = parseSseEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (!event) continue;
+            
+            if (event.type === 'token') {
+                text += event.data.text;
+                if (!messageContent) {
+                    hideTypingIndicator();
+                    messageContent = addMessage(text, 'assistant');
+                } else {
+                    messageContent.innerHTML = formatMessage(text);
+                    scrollToBottom();
+                }
+            } else if (event.type === 'done') {
+                result = event.data;
+            }
+        }
+    }
+    
+    if (!messageContent) {
+        throw new Error('Empty response stream');
+    }
+    if (!result) {
+        throw new Error('Response stream ended unexpectedly');
+    }
+    
+    return { response: text, ...result };
+}
+
+// Parse a single Server-Sent Events frame
+function parseSseEvent(frame) {
+    let type = 'message';
+    const dataLines = [];
+    for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) {
+            type = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    }
+    if (dataLines.length === 0) return null;
+    return { type: type, data: JSON.parse(dataLines.join('\n')) };
+}
+
 // Send message with file
 async function sendMessageWithFile(message, fileId, useResearch) {
     const formData = new FormData();
@@ -130,6 +222,17 @@ function addMessage(content, sender) {
         welcomeMessage.remove();
     }
     
+    const messageDiv = createMessageElement(content, sender);
+    chatContainer.appendChild(messageDiv);
+    
+    // Scroll to bottom
+    scrollToBottom();
+    
+    return messageDiv.querySelector('.message-content');
+}
+
+// Build a message element without inserting it
+function createMessageElement(content, sender) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${sender}`;
     
@@ -146,16 +249,29 @@ function addMessage(content, sender) {
     messageDiv.appendChild(avatar);
     messageDiv.appendChild(messageContent);
     
-    chatContainer.appendChild(messageDiv);
-    
-    // Scroll to bottom
+    return messageDiv;
+}
+
+// Scroll chat to the latest message
+function scrollToBottom() {
+    const chatContainer = document.getElementById('chatContainer');
     chatContainer.scrollTop = chatContainer.scrollHeight;
 }
 
+// Escape text for use in HTML
+function escapeHtml(text) {
+    return String(text)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
 // Format message content
 function formatMessage(content) {
-    // Basic markdown-like formatting
-    let formatted = content
+    // Basic markdown-like formatting, applied to escaped text so stored messages cannot inject markup
+    let formatted = escapeHtml(content)
         .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
         .replace(/\*(.*?)\*/g, '<em>$1</em>')
         .replace(/`(.*?)`/g, '<code>$1</code>')
@@ -290,7 +406,9 @@ function hideLoading() {
 // Start new chat
 function startNewChat() {
     currentConversationId = null;
+    earliestMessageCursor = null;
     uploadedFile = null;
+    setActiveChat(null);
     
     // Clear chat container
     const chatContainer = document.getElementById('chatContainer');
@@ -322,10 +440,145 @@ function toggleSidebar() {
     sidebar.classList.toggle('open');
 }
 
-// Select chat (placeholder for future implementation)
-function selectChat(chatId) {
-    // This would load a specific chat conversation
-    console.log('Selected chat:', chatId);
+// Conversations started in this browser, most recently used first ({conversation_id, title})
+function loadOwnConversations() {
+    try {
+        return JSON.parse(localStorage.getItem(OWN_CONVERSATIONS_KEY)) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+function saveOwnConversations(conversations) {
+    try {
+        localStorage.setItem(OWN_CONVERSATIONS_KEY, JSON.stringify(conversations.slice(0, MAX_OWN_CONVERSATIONS)));
+    } catch (error) {
+        console.error('Error saving conversations:', error);
+    }
+}
+
+// Move a conversation to the top of this browser's list, titled after its first message
+function rememberConversation(conversationId, firstMessage) {
+    const conversations = loadOwnConversations();
+    const existing = conversations.find(conversation => conversation.conversation_id === conversationId);
+    const title = existing ? existing.title : (firstMessage.length > 50 ? firstMessage.slice(0, 50) + '...' : firstMessage);
+    saveOwnConversations([
+        { conversation_id: conversationId, title: title },
+        ...conversations.filter(conversation => conversation.conversation_id !== conversationId)
+    ]);
+}
+
+function forgetConversation(conversationId) {
+    saveOwnConversations(loadOwnConversations().filter(conversation => conversation.conversation_id !== conversationId));
+}
+
+// List this browser's conversations in the sidebar; other users' conversations are never shown
+function loadConversationList() {
+    const conversations = loadOwnConversations();
+    if (!conversations.length) return;
+    
+    const chatHistory = document.querySelector('.chat-history');
+    chatHistory.innerHTML = '';
+    conversations.forEach(conversation => {
+        const item = document.createElement('div');
+        item.className = 'chat-history-item';
+        item.dataset.conversationId = conversation.conversation_id;
+        item.onclick = () => selectChat(conversation.conversation_id);
+        
+        const icon = document.createElement('i');
+        icon.className = 'fas fa-message';
+        const title = document.createElement('span');
+        title.textContent = conversation.title;
+        
+        item.appendChild(icon);
+        item.appendChild(title);
+        chatHistory.appendChild(item);
+    });
+    setActiveChat(currentConversationId);
+}
+
+// Highlight the open conversation in the sidebar
+function setActiveChat(chatId) {
+    document.querySelectorAll('.chat-history-item').forEach(item => {
+        item.classList.toggle('active', (item.dataset.conversationId || null) === chatId);
+    });
+}
+
+// Open a conversation, loading only its latest messages
+async function selectChat(chatId) {
+    if (chatId === 'default' || chatId === currentConversationId) return;
+    
+    try {
+        const response = await fetch(`/api/conversations/${encodeURIComponent(chatId)}?limit=${HISTORY_PAGE_SIZE}`);
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const page = await response.json();
+        if (page.message_count === 0) {
+            // Expired or deleted on the server
+            forgetConversation(chatId);
+            document.querySelectorAll('.chat-history-item').forEach(item => {
+                if (item.dataset.conversationId === chatId) item.remove();
+            });
+            return;
+        }
+        
+        currentConversationId = chatId;
+        uploadedFile = null;
+        document.getElementById('filePreview').style.display = 'none';
+        setActiveChat(chatId);
+        
+        const chatContainer = document.getElementById('chatContainer');
+        chatContainer.innerHTML = '';
+        page.messages.forEach(message => chatContainer.appendChild(createMessageElement(message.content, message.role)));
+        setEarliestCursor(page.prev_cursor);
+        scrollToBottom();
+    } catch (error) {
+        console.error('Error loading conversation:', error);
+    }
+}
+
+// Show a "load earlier" button at the top while older messages exist
+function setEarliestCursor(cursor) {
+    earliestMessageCursor = cursor;
+    const chatContainer = document.getElementById('chatContainer');
+    let button = document.getElementById('loadEarlierButton');
+    if (cursor === null) {
+        if (button) button.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'loadEarlierButton';
+        button.className = 'load-earlier-btn';
+        button.textContent = 'Load earlier messages';
+        button.onclick = loadEarlierMessages;
+    }
+    chatContainer.prepend(button);
+}
+
+// Prepend the page of messages before the earliest one shown, keeping the scroll position
+async function loadEarlierMessages() {
+    if (earliestMessageCursor === null || !currentConversationId) return;
+    
+    const conversationId = currentConversationId;
+    try {
+        const response = await fetch(
+            `/api/conversations/${encodeURIComponent(conversationId)}?limit=${HISTORY_PAGE_SIZE}&before=${earliestMessageCursor}`
+        );
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const page = await response.json();
+        if (conversationId !== currentConversationId) return;
+        
+        const chatContainer = document.getElementById('chatContainer');
+        const button = document.getElementById('loadEarlierButton');
+        const previousHeight = chatContainer.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        page.messages.forEach(message => fragment.appendChild(createMessageElement(message.content, message.role)));
+        button.after(fragment);
+        setEarliestCursor(page.prev_cursor);
+        chatContainer.scrollTop += chatContainer.scrollHeight - previousHeight;
+    } catch (error) {
+        console.error('Error loading earlier messages:', error);
+    }
 }
 
 // Close sidebar when clicking outside (mobile)
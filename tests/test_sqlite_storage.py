@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+
+from backend.sqlite_storage import SQLiteConversationStore, SQLiteDatabase, SQLiteFileStore
+
+
+def _contents(conversation):
+    return [message.content for message in conversation.messages]
+
+
+def test_concurrent_appends_from_two_workers(tmp_path):
+    """Two workers appending to one conversation before flushing both end up with the stored order"""
+    path = str(tmp_path / "chat.db")
+    # Each worker process has its own database handle and cache
+    worker_a = SQLiteConversationStore(SQLiteDatabase(path))
+    worker_b = SQLiteConversationStore(SQLiteDatabase(path))
+
+    async def scenario():
+        for content in ("m0", "m1", "m2"):
+            worker_a.add_message("c", "user", content)
+        await worker_a.flush()
+        assert _contents(await worker_b.get("c")) == ["m0", "m1", "m2"]
+
+        worker_a.add_message("c", "user", "A3")
+        worker_b.add_message("c", "user", "B3")
+        await worker_a.flush()
+        await worker_b.flush()
+
+        expected = ["m0", "m1", "m2", "A3", "B3"]
+        for store in (worker_a, worker_b):
+            conversation = await store.get("c")
+            assert _contents(conversation) == expected
+            assert conversation.message_count == len(expected)
+            assert [message.content for message in await store.messages("c", 0, 10)] == expected
+
+    asyncio.run(scenario())
+
+
+def test_cached_bytes_follow_reloaded_messages(tmp_path):
+    path = str(tmp_path / "chat.db")
+    worker_a = SQLiteConversationStore(SQLiteDatabase(path))
+    worker_b = SQLiteConversationStore(SQLiteDatabase(path))
+
+    async def scenario():
+        worker_a.add_message("c", "user", "first")
+        await worker_a.flush()
+        await worker_b.get("c")
+        worker_a.add_message("c", "user", "from a" * 100)
+        worker_b.add_message("c", "user", "from b")
+        await worker_a.flush()
+        await worker_b.flush()
+
+        conversation = await worker_b.get("c")
+        assert _contents(conversation) == ["first", "from a" * 100, "from b"]
+        assert worker_b.memory_usage()["bytes"] == conversation.nbytes
+
+    asyncio.run(scenario())
+
+
+def test_cache_keeps_recent_window(tmp_path):
+    path = str(tmp_path / "chat.db")
+    writer = SQLiteConversationStore(SQLiteDatabase(path), window_tokens=10)
+    reader = SQLiteConversationStore(SQLiteDatabase(path), window_tokens=10)
+    contents = [f"message {i:02d} " * 3 for i in range(20)]  # 10 tokens each
+
+    async def scenario():
+        for content in contents[:10]:
+            writer.add_message("c", "user", content)
+        await writer.flush()
+        assert _contents(await reader.get("c")) == contents[8:10]
+
+        for content in contents[10:]:
+            writer.add_message("c", "user", content)
+        reader.add_message("c", "assistant", "reply")
+        await writer.flush()
+        await reader.flush()
+        assert [message.content for message in await reader.messages("c", 0, 21)] == contents + ["reply"]
+        conversation = await reader.get("c")
+        assert _contents(conversation) == [contents[19], "reply"]
+        assert conversation.message_count == 21
+        assert reader.memory_usage()["bytes"] == conversation.nbytes
+
+    asyncio.run(scenario())
+
+
+def test_file_content_is_stored_once(tmp_path):
+    path = str(tmp_path / "chat.db")
+    worker_a = SQLiteFileStore(SQLiteDatabase(path), spool_threshold=16)
+    worker_b = SQLiteFileStore(SQLiteDatabase(path), spool_threshold=16)
+    data = b"content " * 1000
+    info = {"filename": "a.txt", "content_type": "text/plain", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+    async def scenario():
+        for file_id, store in (("f1", worker_a), ("f2", worker_b)):
+            blob = store.new_blob()
+            blob.write(data)
+            await store.add(file_id, dict(info), blob)
+        assert worker_a.stats() == {"files": 2, "blobs": 1}
+        assert await worker_b.read(info["sha256"]) == data
+        assert await worker_a.delete("f1") is None
+        assert await worker_b.delete("f2") == info["sha256"]
+
+    asyncio.run(scenario())
+    assert worker_a.stats() == {"files": 0, "blobs": 0}